@@ -0,0 +1,60 @@
+import os
+import random
+import statistics
+import time
+
+import django
+
+WORDS = [
+    'новости', 'игра', 'обновление', 'релиз', 'патч', 'сервер', 'версия', 'студия', 'трейлер', 'обзор',
+    'game', 'release', 'update', 'server', 'studio', 'review', 'trailer', 'engine', 'player', 'level',
+]
+
+
+def setup(database=True):
+    # Django with benchmarks.settings; benchmarks that need a database get a fresh file
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    django.setup()
+    if not database:
+        return
+    from django.conf import settings
+    from django.core.management import call_command
+
+    path = str(settings.DATABASES['default']['NAME'])
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def make_vocabulary(size, seed=0):
+    # WORDS plus generated ones, so word frequencies follow a long tail like real text
+    rng = random.Random(seed)
+    letters = 'абвгдежзиклмнопрстуфхцчшэюяabcdefghijklmnopqrstuvwxyz'
+    generated = {''.join(rng.choice(letters) for _ in range(rng.randint(4, 10))) for _ in range(size)}
+    return WORDS + sorted(generated)
+
+
+def make_text(rng, vocabulary, words):
+    # Zipf-like: the first words of the vocabulary are by far the most frequent
+    return ' '.join(vocabulary[min(int(rng.paretovariate(1.1)) - 1, len(vocabulary) - 1)] for _ in range(words))
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def report(name, values, unit='ms', scale=1000):
+    # p50, p95 and mean of a list of timings in seconds
+    print(
+        f"{name:<40} p50 {percentile(values, 50) * scale:9.2f} {unit}"
+        f"  p95 {percentile(values, 95) * scale:9.2f} {unit}"
+        f"  mean {statistics.mean(values) * scale:9.2f} {unit}"
+    )
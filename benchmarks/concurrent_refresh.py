@@ -0,0 +1,125 @@
+# Page loads while a refresh writes (user-017). A writer thread inserts articles through
+# add_articles, as the refresh worker does, while reader threads open feed pages, the API
+# listing and unread articles (which marks them read). Reports request latencies and how
+# many requests failed with "database is locked". --stock-backend runs the same load on
+# Django's own SQLite backend, without the pragmas and BEGIN IMMEDIATE of reader.sqlite3.
+#
+#   python -m benchmarks.concurrent_refresh [--readers 4] [--articles 5000] [--stock-backend]
+import argparse
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from .common import report, setup, timed
+
+BATCH_SIZE = 50
+
+
+def make_entries(start, count):
+    first_published = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            'title': f'Article {number}',
+            'description': f'<p>Description of article {number}</p>',
+            'url': f'https://example.com/articles/{number}',
+            'guid': f'article-{number}',
+            'published': first_published + timedelta(minutes=number),
+            'thumbnail': ''
+        }
+        for number in range(start, start + count)
+    ]
+
+
+def run_writer(feeds, start, count, results, stop):
+    from django.db import OperationalError, connection
+    from reader.models import Article
+
+    try:
+        for number, batch_start in enumerate(range(start, start + count, BATCH_SIZE)):
+            try:
+                _, seconds = timed(Article.add_articles, feeds[number % len(feeds)], make_entries(batch_start, BATCH_SIZE))
+                results['write'].append(seconds)
+            except OperationalError as e:
+                results['errors'].append(f'write: {e}')
+    finally:
+        stop.set()
+        connection.close()
+
+
+def run_reader(feeds, results, stop, seed):
+    from django.db import OperationalError, connection
+    from django.test import Client
+    from reader.models import Article
+
+    rng = random.Random(seed)
+    client = Client()
+    try:
+        while not stop.is_set():
+            feed = rng.choice(feeds)
+            try:
+                _, seconds = timed(client.get, f'/{feed.board.slug}/{feed.slug}/')
+                results['feed page'].append(seconds)
+                _, seconds = timed(client.get, f'/api/articles/?feed={feed.slug}&unread=1')
+                results['api listing'].append(seconds)
+                article = Article.objects.filter(feed=feed, is_read=False).only('slug').first()
+                if article:
+                    _, seconds = timed(client.get, f'/{feed.board.slug}/{feed.slug}/{article.slug}/')
+                    results['article page (marks read)'].append(seconds)
+            except OperationalError as e:
+                results['errors'].append(f'read: {e}')
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readers', type=int, default=4, help="Threads loading pages")
+    parser.add_argument('--feeds', type=int, default=20)
+    parser.add_argument('--articles', type=int, default=5000, help="Articles written during the run")
+    parser.add_argument('--stock-backend', action='store_true')
+    options = parser.parse_args()
+    if options.stock_backend:
+        os.environ['BENCHMARK_DATABASE_ENGINE'] = 'django.db.backends.sqlite3'
+    setup()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    from reader.models import Article, Board, Feed
+
+    setup_test_environment()
+    board = Board.add_board('Board', 'board')
+    feeds = [
+        Feed.add_feed(f'Feed {number}', '', 'https://example.com/', f'https://example.com/{number}/rss', board)
+        for number in range(options.feeds)
+    ]
+    for number, feed in enumerate(feeds):
+        Article.add_articles(feed, make_entries(number * 100, 100))
+    connection.close()
+
+    results = {'feed page': [], 'api listing': [], 'article page (marks read)': [], 'write': [], 'errors': []}
+    stop = threading.Event()
+    threads = [threading.Thread(target=run_writer, args=(feeds, len(feeds) * 100, options.articles, results, stop))]
+    threads += [threading.Thread(target=run_reader, args=(feeds, results, stop, number)) for number in range(options.readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    print(f"{settings.DATABASES['default']['ENGINE']}: {options.readers} readers, "
+          f"{options.articles} articles written in {seconds:.1f}s")
+    for name, values in results.items():
+        if name != 'errors' and values:
+            report(f'{name} ({len(values)})', values)
+    print(f"database is locked: {sum('database is locked' in error for error in results['errors'])}, "
+          f"other errors: {sum('database is locked' not in error for error in results['errors'])}")
+    for error in sorted(set(results['errors']))[:5]:
+        print(f"  {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Per-date cost of publication date parsing (user-023): reader.dates.parse_datetime with its
+# RFC 822 / ISO 8601 fast paths and per-feed parser cache, against the strptime functions
+# the parsers used before, for the formats the sources send.
+#
+#   python -m benchmarks.date_parsing [--dates 50000]
+import argparse
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+from .common import setup, timed
+
+USER_UTC = 4
+USER_TIMEZONE = 'Europe/Saratov'
+
+
+def convert_to_datetime(datetime_string):
+    # the RSS date parser before reader.dates: two strptime formats and a fixed offset
+    try:
+        raw_datetime = datetime.strptime(datetime_string, '%a, %d %b %Y %H:%M:%S %z')
+    except ValueError:
+        raw_datetime = datetime.strptime(datetime_string, '%a, %d %b %Y %H:%M:%S %Z')
+    if raw_datetime.tzinfo is None:
+        raw_datetime = raw_datetime.replace(tzinfo=pytz.timezone(USER_TIMEZONE))
+    return raw_datetime + timedelta(hours=USER_UTC)
+
+
+def convert_to_datetime_kanobu(str_date):
+    return datetime.strptime(str_date, '%Y-%m-%dT%H:%M:%S%z')
+
+
+def convert_to_datetime_tj(str_date):
+    return datetime.strptime(str_date, '%d-%m-%y')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dates', type=int, default=50000, help="Dates of every format")
+    options = parser.parse_args()
+    setup(database=False)
+
+    from reader.dates import DateParser
+
+    rng = random.Random(0)
+    first = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    dates = [first + timedelta(minutes=rng.randint(0, 500000)) for _ in range(options.dates)]
+    formats = {
+        'RFC 822, +0000': ([date.strftime('%a, %d %b %Y %H:%M:%S +0000') for date in dates], convert_to_datetime),
+        'RFC 822, GMT': ([date.strftime('%a, %d %b %Y %H:%M:%S GMT') for date in dates], convert_to_datetime),
+        'ISO 8601': ([date.strftime('%Y-%m-%dT%H:%M:%S+00:00') for date in dates], convert_to_datetime_kanobu),
+        'dd-mm-yy': ([date.strftime('%d-%m-%y') for date in dates], convert_to_datetime_tj),
+    }
+
+    print(f"{'format':<16}{'strptime':>12}{'parse_datetime':>18}{'uncached':>16}")
+    for name, (values, old_parser) in formats.items():
+        _, old_seconds = timed(lambda: [old_parser(value) for value in values])
+        # one feed sends all the dates, so after the first one its parser is tried first
+        date_parser = DateParser()
+        _, new_seconds = timed(lambda: [date_parser.parse(value, name) for value in values])
+        # a new key for every date: each one goes through the fallback chain from the start
+        date_parser = DateParser()
+        _, chain_seconds = timed(lambda: [date_parser.parse(value, number) for number, value in enumerate(values)])
+        scale = 1e6 / len(values)
+        print(f"{name:<16}{old_seconds * scale:9.2f} µs{new_seconds * scale:15.2f} µs{chain_seconds * scale:13.2f} µs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Per-entry CPU time of RSS entry HTML processing (user-008): the single lxml pass of
+# process_html against the three BeautifulSoup parses it replaced.
+#
+#   python -m benchmarks.html_processing [--entries 200] [--paragraphs 20]
+import argparse
+import random
+import re
+
+from bs4 import BeautifulSoup
+
+from .common import make_text, make_vocabulary, report, setup, timed
+
+
+def make_entry_html(rng, vocabulary, paragraphs):
+    # a long article: paragraphs with links and inline markup, an image every few paragraphs
+    parts = []
+    for number in range(paragraphs):
+        text = make_text(rng, vocabulary, 60)
+        parts.append(f'<p>{text}. <a href="https://example.com/{number}">{make_text(rng, vocabulary, 3)}</a> <b>{text[:40]}</b></p>')
+        if number % 4 == 0:
+            parts.append(f'<figure><img src="https://cdn.example.com/{number}.jpg" alt=""><br/></figure>')
+    return ''.join(parts)
+
+
+def process_with_soup(description, content):
+    # what parse_rss did before: text, first sentence and thumbnail each parsed the HTML again
+    text = BeautifulSoup(description, 'html.parser').get_text()
+    sentence_html = re.sub(r'<br\s*/?>|<hr\s*/?>', '.', description)
+    sentence_text = BeautifulSoup(sentence_html, 'html.parser').get_text(separator=' ')
+    first_sentence = re.split(r'[.?!]', re.sub(r'<.*?>', '', sentence_text), maxsplit=1)[0]
+    images = [img.get('src') for img in BeautifulSoup(content, 'html.parser').find_all('img')]
+    return text, first_sentence, images
+
+
+def process_with_lxml(description, content):
+    from reader.utils import process_html
+
+    processed = process_html(description)
+    return processed['text'], processed['first_sentence'], process_html(content)['images']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=200)
+    parser.add_argument('--paragraphs', type=int, default=20)
+    options = parser.parse_args()
+    setup(database=False)
+
+    rng = random.Random(0)
+    vocabulary = make_vocabulary(5000)
+    entries = [
+        (make_entry_html(rng, vocabulary, options.paragraphs), make_entry_html(rng, vocabulary, options.paragraphs))
+        for _ in range(options.entries)
+    ]
+    print(f"{options.entries} entries, {sum(len(d) + len(c) for d, c in entries) // options.entries} bytes of HTML each")
+    for name, process in (('BeautifulSoup, three parses', process_with_soup), ('lxml, one pass', process_with_lxml)):
+        report(name, [timed(process, description, content)[1] for description, content in entries], 'ms/entry')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Latency of the article listing queries as the table grows (user-010). Articles are seeded
+# in steps with plain INSERTs, bypassing ingestion, and after every step each query runs for
+# a sample of feeds. With the composite indexes the timings should stay flat.
+#
+#   python -m benchmarks.listing_queries [--feeds 300] [--steps 100000,1000000,3000000]
+import argparse
+import hashlib
+import random
+from datetime import datetime, timedelta, timezone
+
+from .common import report, setup, timed
+
+INSERT_BATCH_SIZE = 10000
+
+
+def seed_feeds(count):
+    from reader.models import Board, Feed
+
+    board = Board.add_board('Board', 'board')
+    return [
+        Feed.add_feed(f'Feed {number}', '', 'https://example.com/', f'https://example.com/{number}/rss', board)
+        for number in range(count)
+    ]
+
+
+def seed_articles(feeds, start, stop, rng):
+    # one article every few minutes per feed, most of them read
+    from django.db import connection, transaction
+
+    first_published = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    for batch_start in range(start, stop, INSERT_BATCH_SIZE):
+        rows = []
+        for number in range(batch_start, min(batch_start + INSERT_BATCH_SIZE, stop)):
+            guid_hash = hashlib.sha1(str(number).encode()).hexdigest()
+            rows.append((
+                f'Article {number}', f'article-{guid_hash[:8]}', guid_hash, 'Description',
+                f'https://example.com/articles/{number}', first_published + timedelta(minutes=number * 3 // len(feeds)),
+                '', rng.random() < 0.9, feeds[number % len(feeds)].id
+            ))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO reader_article (title, slug, guid_hash, description, url, published, thumbnail, is_read, feed_id) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                rows
+            )
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+def get_queries():
+    from reader.models import Article, Feed
+    from reader.views import ARTICLE_LIST_FIELDS, FEED_LENGTH
+
+    def feed_pages(feed):
+        # the first page and the one after it, as the feed page pages with its cursor
+        articles = Article.get_feed_articles(feed.slug).only(*ARTICLE_LIST_FIELDS)
+        _, cursor = Article.get_page(articles, None, FEED_LENGTH)
+        return Article.get_page(articles, cursor, FEED_LENGTH)
+
+    return {
+        'feed page and the next one': feed_pages,
+        'unread of a feed': lambda feed: list(
+            Article.objects.filter(feed=feed, is_read=False).order_by('-published', '-id')[:FEED_LENGTH]
+        ),
+        'get_last_articles': lambda feed: list(Article.get_last_articles(feed, 10)),
+        'unread of all feeds': lambda feed: Article.get_page(Article.get_unread_articles(), None, FEED_LENGTH),
+        'get_feed_by_url': lambda feed: Feed.get_feed_by_url(feed.feed_url),
+        'get_first_feed': lambda feed: Feed.get_first_feed(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--feeds', type=int, default=300)
+    parser.add_argument('--steps', default='100000,1000000,3000000', help="Table sizes to measure at")
+    parser.add_argument('--samples', type=int, default=200, help="Feeds queried per measurement")
+    options = parser.parse_args()
+    setup()
+
+    rng = random.Random(0)
+    feeds = seed_feeds(options.feeds)
+    queries = get_queries()
+    seeded = 0
+    for step in [int(size) for size in options.steps.split(',')]:
+        _, seconds = timed(seed_articles, feeds, seeded, step, rng)
+        print(f"\n{step} articles ({step - seeded} seeded in {seconds:.0f}s)")
+        seeded = step
+        for name, query in queries.items():
+            sample = [rng.choice(feeds) for _ in range(options.samples)]
+            report(name, [timed(query, feed)[1] for feed in sample])
+
+
+if __name__ == '__main__':
+    main()
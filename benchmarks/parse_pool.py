@@ -0,0 +1,79 @@
+# Parse stage throughput with threads and with worker processes (user-024). Telegram channel
+# pages, the most CPU-heavy source, go through timed_parse_source as the refresh parse pool
+# runs it: in REFRESH_PARSE_WORKERS threads, then in 1..N spawned processes. Processes only
+# pay off with more than one core, on a single core they add pickling and start-up costs.
+#
+#   python -m benchmarks.parse_pool [--channels 40] [--messages 180] [--processes 1,2,4]
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+import django
+
+from .common import setup, timed
+
+
+def make_telegram_page(channel, first_id, count):
+    first_published = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    messages = ''.join(
+        f'<div class="tgme_widget_message_wrap"><div class="tgme_widget_message js-widget_message" data-post="{channel}/{message_id}">'
+        f'<a class="tgme_widget_message_photo_wrap" style="width:100px;background-image:url(\'https://cdn.example.com/{message_id}.jpg\')"></a>'
+        f'<div class="tgme_widget_message_text js-message_text">Message {message_id} of {channel} &amp; more. '
+        f'Second sentence<br/><b>bold</b> and <a href="https://example.com/{message_id}">a link</a>.</div>'
+        f'<a class="tgme_widget_message_date" href="https://t.me/{channel}/{message_id}">'
+        f'<time datetime="{(first_published + timedelta(minutes=message_id)).isoformat()}"></time></a>'
+        f'</div></div>'
+        for message_id in range(first_id, first_id + count)
+    )
+    return f'<html><head><meta charset="utf-8"></head><body>{messages}</body></html>'.encode()
+
+
+def parse_all(pool, work):
+    from reader.refresh import timed_parse_source
+
+    futures = [pool.submit(timed_parse_source, adapter, pages) for adapter, pages in work]
+    wait(futures)
+    return sum(len(future.result()[1]) for future in futures)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', type=int, default=40)
+    parser.add_argument('--messages', type=int, default=180, help="Messages per channel, 20 to a page")
+    parser.add_argument('--processes', default='1,2,4', help="Process pool sizes to measure")
+    options = parser.parse_args()
+    setup(database=False)
+
+    from django.conf import settings
+    from reader.sources import get_adapter
+
+    work = []
+    for number in range(options.channels):
+        channel = f'channel{number}'
+        adapter = get_adapter({'title': channel, 'url': f'https://t.me/{channel}', 'type': 'Telegram', 'board': 'Board'})
+        work.append((adapter, [make_telegram_page(channel, first_id, 20) for first_id in range(1, options.messages + 1, 20)]))
+    print(f"{options.channels} channels x {options.messages} messages, {os.cpu_count()} CPU cores")
+
+    with ThreadPoolExecutor(max_workers=settings.REFRESH_PARSE_WORKERS) as pool:
+        entries, seconds = timed(parse_all, pool, work)
+    print(f"{f'{settings.REFRESH_PARSE_WORKERS} threads':<28}{seconds:6.2f}s  {entries / seconds:8.0f} entries/s")
+
+    for processes in [int(size) for size in options.processes.split(',')]:
+        started = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup
+        ) as pool:
+            # start every worker first, the pool lives as long as the refresh worker
+            wait([pool.submit(os.getpid) for _ in range(processes * 4)])
+            start_up = time.perf_counter() - started
+            entries, seconds = timed(parse_all, pool, work)
+        print(f"{f'{processes} processes (start {start_up:.1f}s)':<28}{seconds:6.2f}s  {entries / seconds:8.0f} entries/s")
+
+
+if __name__ == '__main__':
+    main()
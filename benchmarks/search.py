@@ -0,0 +1,84 @@
+# Full-text search cost and latency (user-014): ingestion throughput of add_articles with
+# and without the FTS5 index, the rebuild_index throughput, and search latency for words
+# of different frequency over a synthetic corpus.
+#
+#   python -m benchmarks.search [--articles 50000] [--feeds 50] [--samples 50]
+import argparse
+import random
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from .common import make_text, make_vocabulary, report, setup, timed
+
+BATCH_SIZE = 100
+
+
+def make_entries(rng, vocabulary, start, count):
+    first_published = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            'title': make_text(rng, vocabulary, 8),
+            'description': f'<p>{make_text(rng, vocabulary, 80)}</p><p>{make_text(rng, vocabulary, 80)}</p>',
+            'url': f'https://example.com/articles/{number}',
+            'guid': f'article-{number}',
+            'published': first_published + timedelta(minutes=number),
+            'thumbnail': ''
+        }
+        for number in range(start, start + count)
+    ]
+
+
+def ingest(feeds, entries):
+    # refresh-sized batches, one add_articles call each
+    from reader.models import Article
+
+    for number, start in enumerate(range(0, len(entries), BATCH_SIZE)):
+        Article.add_articles(feeds[number % len(feeds)], entries[start:start + BATCH_SIZE])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--articles', type=int, default=50000, help="Articles ingested with the index")
+    parser.add_argument('--feeds', type=int, default=50)
+    parser.add_argument('--samples', type=int, default=50, help="Runs of every query")
+    options = parser.parse_args()
+    setup()
+
+    from reader import search
+    from reader.models import Board, Feed
+
+    rng = random.Random(0)
+    vocabulary = make_vocabulary(20000)
+    boards = [Board.add_board(f'Board {number}', f'board-{number}') for number in range(2)]
+    feeds = [
+        Feed.add_feed(f'Feed {number}', '', 'https://example.com/', f'https://example.com/{number}/rss', boards[number % 2])
+        for number in range(options.feeds)
+    ]
+
+    # the same amount of text without the index, as a baseline for the indexing cost
+    count = options.articles // 5
+    entries = make_entries(rng, vocabulary, 0, count)
+    with mock.patch.object(search, 'index_articles'):
+        _, seconds = timed(ingest, feeds, entries)
+    print(f"ingestion without the index  {count / seconds:8.0f} articles/s")
+    entries = make_entries(rng, vocabulary, count, options.articles)
+    _, seconds = timed(ingest, feeds, entries)
+    print(f"ingestion with the index     {options.articles / seconds:8.0f} articles/s")
+    total, seconds = timed(search.rebuild_index)
+    print(f"rebuild_index                {total / seconds:8.0f} articles/s ({total} articles)\n")
+
+    queries = {
+        f'common word ({vocabulary[0]})': (vocabulary[0], None, None),
+        f'mid-frequency word ({vocabulary[60]})': (vocabulary[60], None, None),
+        f'rare word ({vocabulary[3000]})': (vocabulary[3000], None, None),
+        'two words': (f'{vocabulary[1]} {vocabulary[60]}', None, None),
+        f'prefix ({vocabulary[2][:4]}*)': (vocabulary[2][:4], None, None),
+        'common word in one board': (vocabulary[0], boards[0].slug, None),
+        'common word in one feed': (vocabulary[0], None, feeds[0].slug),
+    }
+    for name, arguments in queries.items():
+        report(name, [timed(search.search, *arguments)[1] for _ in range(options.samples)])
+
+
+if __name__ == '__main__':
+    main()
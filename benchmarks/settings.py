@@ -0,0 +1,20 @@
+# Settings for the benchmark scripts: a throwaway SQLite file instead of db.sqlite3 and an
+# in-process cache. BENCHMARK_DATABASE picks another file, e.g. on the disk the site runs from,
+# BENCHMARK_DATABASE_ENGINE another backend to compare with.
+import os
+import tempfile
+
+from rune.settings import *  # noqa: F401,F403
+
+DATABASES = {
+    "default": {
+        "ENGINE": os.environ.get("BENCHMARK_DATABASE_ENGINE") or "reader.sqlite3",
+        "NAME": os.environ.get("BENCHMARK_DATABASE") or os.path.join(tempfile.gettempdir(), "rune-benchmark.sqlite3"),
+    }
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
@@ -1,3 +1,16 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import FetchLog
+
+
+@admin.register(FetchLog)
+class FetchLogAdmin(admin.ModelAdmin):
+    # slowest refreshes first
+    list_display = (
+        'title', 'started', 'status', 'total_time', 'ttfb', 'download_time', 'parse_time', 'db_time',
+        'bytes', 'entries_seen', 'entries_inserted', 'error'
+    )
+    list_filter = ('status', 'title')
+    ordering = ('-total_time',)
+    date_hierarchy = 'started'
+    search_fields = ('title', 'feed_url')
@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ReaderConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "reader"
+
+    def ready(self):
+        from .search import create_index
+        post_migrate.connect(create_index, sender=self)
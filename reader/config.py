@@ -0,0 +1,134 @@
+import hashlib
+import os
+import threading
+
+import yaml
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import page_cache
+from .models import Board, Feed
+
+SYNC_COUNTS = ('boards_added', 'boards_updated', 'boards_removed', 'feeds_added', 'feeds_updated', 'feeds_removed')
+
+
+class ConfigCache:
+    # boards.yml is re-read only when its mtime changes and re-parsed only when its content
+    # hash changes, so the worker can load it on every pass for the price of one stat()
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.path = None
+        self.mtime = None
+        self.content_hash = None
+        self.boards = None
+        self.synced_hash = None
+
+    def load(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            if path != self.path or mtime != self.mtime:
+                with open(path, 'rb') as file:
+                    content = file.read()
+                content_hash = hashlib.sha256(content).hexdigest()
+                if path != self.path or content_hash != self.content_hash:
+                    self.boards = yaml.safe_load(content)['boards']
+                    self.content_hash = content_hash
+                self.path = path
+                self.mtime = mtime
+            return self.boards, self.content_hash
+
+
+config_cache = ConfigCache()
+
+
+def load_boards():
+    return config_cache.load(settings.BOARDS_CONFIG)[0]
+
+
+def sync_boards(boards):
+    # Applies the config to the database in one transaction, writing only what differs.
+    # New feeds are created without a site url and subtitle, their first refresh fills them in.
+    # Feeds dropped from the config are detached from their board and keep their articles.
+    counts = dict.fromkeys(SYNC_COUNTS, 0)
+    touched_board_ids = set()
+
+    with transaction.atomic():
+        existing_boards = {board.slug: board for board in Board.objects.all()}
+        config_slugs = {board['slug'] for board in boards}
+
+        new_boards = [
+            Board(title=board['title'], slug=board['slug'])
+            for board in boards if board['slug'] not in existing_boards
+        ]
+        Board.objects.bulk_create(new_boards)
+        changed_boards = []
+        for board in boards:
+            existing_board = existing_boards.get(board['slug'])
+            if existing_board is not None and existing_board.title != board['title']:
+                existing_board.title = board['title']
+                changed_boards.append(existing_board)
+        Board.objects.bulk_update(changed_boards, ['title'])
+        removed_slugs = [slug for slug in existing_boards if slug not in config_slugs]
+        # feeds of a removed board are detached by on_delete=SET_NULL
+        Board.objects.filter(slug__in=removed_slugs).delete()
+
+        board_ids = dict(Board.objects.values_list('slug', 'id'))
+        wanted_feeds = {
+            feed['url']: (feed['title'], board_ids[board['slug']])
+            for board in boards for feed in board['feeds']
+        }
+        changed_feeds = []
+        existing_urls = set()
+        taken_slugs = set()
+        for feed in Feed.objects.only('id', 'title', 'slug', 'feed_url', 'board_id'):
+            existing_urls.add(feed.feed_url)
+            taken_slugs.add(feed.slug)
+            if feed.feed_url in wanted_feeds:
+                title, board_id = wanted_feeds[feed.feed_url]
+                counter = 'feeds_updated'
+            else:
+                title, board_id = feed.title, None
+                counter = 'feeds_removed'
+            if (feed.title, feed.board_id) != (title, board_id):
+                touched_board_ids.update((feed.board_id, board_id))
+                feed.title, feed.board_id = title, board_id
+                changed_feeds.append(feed)
+                counts[counter] += 1
+        Feed.objects.bulk_update(changed_feeds, ['title', 'board'])
+        new_feeds = []
+        for url, (title, board_id) in wanted_feeds.items():
+            if url not in existing_urls:
+                slug = Feed.make_slug(title, url, taken_slugs)
+                taken_slugs.add(slug)
+                new_feeds.append(Feed(title=title, slug=slug, feed_url=url, board_id=board_id, updated=timezone.now()))
+        Feed.objects.bulk_create(new_feeds)
+        touched_board_ids.update(feed.board_id for feed in new_feeds)
+        if changed_feeds or removed_slugs:
+            # boards count the unread articles of their feeds
+            Feed.rebuild_unread_counts()
+
+    counts['boards_added'] = len(new_boards)
+    counts['boards_updated'] = len(changed_boards)
+    counts['boards_removed'] = len(removed_slugs)
+    counts['feeds_added'] = len(new_feeds)
+    if any(counts.values()):
+        touched_board_slugs = {board.slug for board in changed_boards}
+        touched_board_slugs.update(slug for slug, board_id in board_ids.items() if board_id in touched_board_ids)
+        for board_slug in touched_board_slugs:
+            page_cache.invalidate_board(board_slug)
+        for feed in changed_feeds:
+            page_cache.invalidate_feed(feed.slug)
+        page_cache.invalidate_boards()
+    return counts
+
+
+def load_sources():
+    # flat list of feed sources, each one tagged with the title of its board;
+    # the database is synced with the config only after the file has changed
+    boards, content_hash = config_cache.load(settings.BOARDS_CONFIG)
+    if content_hash != config_cache.synced_hash:
+        sync_boards(boards)
+        config_cache.synced_hash = content_hash
+    return [{**feed, 'board': board['title']} for board in boards for feed in board['feeds']]
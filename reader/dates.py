@@ -0,0 +1,73 @@
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+from django.utils import timezone
+
+# Formats tried after the RFC 822 and ISO 8601 fast paths
+DATETIME_PATTERNS = (
+    '%Y-%m-%d %H:%M:%S %z',
+    '%d-%m-%y',
+    '%d.%m.%Y %H:%M',
+    '%d.%m.%Y',
+)
+
+
+def parse_rfc822(value):
+    parsed = parsedate_to_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+def parse_iso(value):
+    return datetime.fromisoformat(value)
+
+
+def make_pattern_parser(pattern):
+    def parse_pattern(value):
+        return datetime.strptime(value, pattern)
+    return parse_pattern
+
+
+DATETIME_PARSERS = (parse_iso, parse_rfc822) + tuple(make_pattern_parser(pattern) for pattern in DATETIME_PATTERNS)
+
+
+class DateParser:
+    # A feed writes all its dates the same way, so the parser that read the last date of a feed
+    # is tried first for the next one and the fallback chain only runs when it fails.
+    def __init__(self):
+        self.parsers = {}
+
+    def parse(self, value, key=None):
+        value = value.strip()
+        cached_parser = self.parsers.get(key)
+        if cached_parser is not None:
+            try:
+                return normalize(cached_parser(value))
+            except (TypeError, ValueError):
+                pass
+        for parser in DATETIME_PARSERS:
+            if parser is cached_parser:
+                continue
+            try:
+                parsed = parser(value)
+            except (TypeError, ValueError):
+                continue
+            self.parsers[key] = parser
+            return normalize(parsed)
+        raise ValueError(f"Неверный формат даты: {value}")
+
+
+def normalize(value):
+    # aware datetime; dates without an offset are in TIME_ZONE
+    if timezone.is_naive(value):
+        return timezone.make_aware(value, timezone.get_default_timezone())
+    return value
+
+
+date_parser = DateParser()
+
+
+def parse_datetime(value, key=None):
+    # key identifies the source, usually the feed title
+    return date_parser.parse(value, key)
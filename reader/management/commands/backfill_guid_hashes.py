@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from reader.models import Article
+
+
+class Command(BaseCommand):
+    help = "Identify articles stored before guid hashes existed, so their entries are not stored again"
+
+    def handle(self, *args, **options):
+        updated, duplicates = Article.backfill_guid_hashes()
+        self.stdout.write(f"Guid hashes set for {updated} articles, {duplicates} duplicates left as they are")
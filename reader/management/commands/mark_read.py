@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from reader import page_cache
+from reader.models import Article
+
+
+class Command(BaseCommand):
+    help = "Mark articles as read with a single UPDATE: a feed, a board, everything older than N days or given ids"
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--feed', help="Feed slug")
+        group.add_argument('--board', help="Board slug")
+        group.add_argument('--older-than', type=int, metavar='DAYS', help="Articles published more than DAYS ago")
+        group.add_argument('--ids', type=int, nargs='+', help="Article ids")
+
+    def handle(self, *args, **options):
+        if options['feed']:
+            unread_by_feed = Article.mark_feed_as_read(options['feed'])
+        elif options['board']:
+            unread_by_feed = Article.mark_board_as_read(options['board'])
+        elif options['older_than'] is not None:
+            if options['older_than'] < 0:
+                raise CommandError("--older-than must not be negative")
+            unread_by_feed = Article.mark_older_as_read(options['older_than'])
+        else:
+            unread_by_feed = Article.mark_ids_as_read(options['ids'])
+
+        page_cache.invalidate_feeds_by_id(unread_by_feed)
+        self.stdout.write(f"{sum(unread_by_feed.values())} articles marked as read in {len(unread_by_feed)} feeds")
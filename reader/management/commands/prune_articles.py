@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from reader import page_cache
+from reader.retention import compact_database, enable_incremental_vacuum, prune_articles
+
+
+class Command(BaseCommand):
+    help = "Delete read articles outside the retention policies of their feeds and compact the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Articles deleted per transaction")
+        parser.add_argument('--archive', metavar='PATH', help="Append pruned articles to this gzipped JSONL file")
+        parser.add_argument('--no-compact', action='store_true', help="Skip ANALYZE and incremental VACUUM")
+        parser.add_argument(
+            '--enable-incremental-vacuum',
+            action='store_true',
+            help="Switch the database to auto_vacuum=INCREMENTAL with one full VACUUM, then exit"
+        )
+
+    def handle(self, *args, **options):
+        if options['enable_incremental_vacuum']:
+            if enable_incremental_vacuum():
+                self.stdout.write("Database converted to auto_vacuum=INCREMENTAL")
+            else:
+                self.stdout.write("Incremental vacuum is only supported on SQLite")
+            return
+
+        deleted_by_feed = prune_articles(options['chunk_size'], options['archive'])
+        page_cache.invalidate_feeds_by_id(deleted_by_feed)
+        self.stdout.write(f"{sum(deleted_by_feed.values())} articles deleted from {len(deleted_by_feed)} feeds")
+
+        if not options['no_compact'] and not compact_database():
+            self.stdout.write(
+                "Incremental vacuum skipped: the database doesn't use auto_vacuum=INCREMENTAL, "
+                "run once with --enable-incremental-vacuum"
+            )
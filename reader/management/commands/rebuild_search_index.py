@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from reader.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of all articles"
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(f"Search index rebuilt with {count} articles")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from reader import page_cache
+from reader.models import Board, Feed
+
+
+class Command(BaseCommand):
+    help = "Recount unread articles of every feed and board"
+
+    def handle(self, *args, **options):
+        feeds_count, boards_count = Feed.rebuild_unread_counts()
+        page_cache.invalidate_boards()
+        for board_slug in Board.objects.values_list('slug', flat=True):
+            page_cache.invalidate_board(board_slug)
+        self.stdout.write(f"Unread counts rebuilt for {feeds_count} feeds and {boards_count} boards")
@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from reader.models import RefreshJob
+from reader.scheduler import RefreshScheduler, backoff_delay
+
+
+class Command(BaseCommand):
+    help = "Keep feeds up to date, refreshing each one when it is due"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Refresh due feeds once and exit")
+
+    def handle(self, *args, **options):
+        scheduler = RefreshScheduler()
+        # jobs left running by a worker that was killed
+        RefreshJob.fail_stale_jobs(settings.REFRESH_JOB_TIMEOUT)
+        failures = 0
+        while True:
+            try:
+                wait = scheduler.run_once()
+                failures = 0
+            except Exception as e:
+                if options['once']:
+                    raise
+                # a broken boards.yml or a locked database must not stop the worker,
+                # the pass is retried later, with longer pauses while it keeps failing
+                failures += 1
+                wait = min(backoff_delay(settings.REFRESH_POLL_INTERVAL, failures - 1), settings.REFRESH_INTERVAL_MIN)
+                self.stderr.write(f"refresh pass failed: {e!r}, retrying in {wait}s")
+            if options['once']:
+                break
+            # wake up at least every poll interval to pick up config changes,
+            # refresh jobs started from the web page are checked for more often
+            deadline = time.monotonic() + (wait if failures else min(wait, settings.REFRESH_POLL_INTERVAL))
+            while time.monotonic() < deadline and not RefreshJob.has_pending_job():
+                time.sleep(min(settings.REFRESH_JOB_POLL_INTERVAL, max(0, deadline - time.monotonic())))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from reader.config import config_cache, load_boards, sync_boards
+
+
+class Command(BaseCommand):
+    help = "Apply boards.yml to the database, writing only the boards and feeds that changed"
+
+    def handle(self, *args, **options):
+        counts = sync_boards(load_boards())
+        config_cache.synced_hash = config_cache.load(settings.BOARDS_CONFIG)[1]
+        self.stdout.write(
+            f"Boards: {counts['boards_added']} added, {counts['boards_updated']} updated, "
+            f"{counts['boards_removed']} removed. "
+            f"Feeds: {counts['feeds_added']} added, {counts['feeds_updated']} updated, "
+            f"{counts['feeds_removed']} detached"
+        )
@@ -0,0 +1,42 @@
+from .models import FetchLog
+
+# (metric name, help, FetchLog field or function of the log)
+FEED_METRICS = (
+    ('rune_feed_fetch_bytes', 'Size of the downloaded body', 'bytes'),
+    ('rune_feed_fetch_status', 'HTTP status, 0 when there was no response', lambda log: log.status or 0),
+    ('rune_feed_entries_seen', 'Entries parsed from the source', 'entries_seen'),
+    ('rune_feed_entries_inserted', 'New articles stored', 'entries_inserted'),
+    ('rune_feed_fetch_error', '1 when the refresh failed', lambda log: int(bool(log.error))),
+    ('rune_feed_fetch_timestamp_seconds', 'Start of the refresh', lambda log: log.started.timestamp()),
+)
+
+STAGE_FIELDS = (
+    ('ttfb', 'ttfb'),
+    ('download', 'download_time'),
+    ('parse', 'parse_time'),
+    ('db', 'db_time'),
+    ('total', 'total_time'),
+)
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics():
+    # Prometheus text exposition of the last refresh of every source
+    logs = list(FetchLog.get_latest_logs())
+    lines = [
+        '# HELP rune_feed_fetch_seconds Time spent in each stage of the last refresh',
+        '# TYPE rune_feed_fetch_seconds gauge',
+    ]
+    for log in logs:
+        for stage, field in STAGE_FIELDS:
+            lines.append(f'rune_feed_fetch_seconds{{feed="{escape_label(log.feed_url)}",stage="{stage}"}} {getattr(log, field)}')
+    for name, help_text, value in FEED_METRICS:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for log in logs:
+            number = value(log) if callable(value) else getattr(log, value)
+            lines.append(f'{name}{{feed="{escape_label(log.feed_url)}"}} {number}')
+    return '\n'.join(lines) + '\n'
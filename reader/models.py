@@ -1,14 +1,24 @@
+import base64
+import binascii
+import hashlib
 import random
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from pytils.translit import slugify
 
+from . import search
+
+ARTICLE_ENTRY_FIELDS = ('title', 'description', 'url', 'published', 'thumbnail')
+
 
 class Board(models.Model):
     id = models.AutoField(primary_key=True)
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=32, unique=True)
+    # denormalized count of unread articles in all feeds of the board, see Feed.change_unread_count
+    unread_count = models.IntegerField(default=0)
 
     def __str__(self):
         return self.title
@@ -44,9 +54,23 @@ class Feed(models.Model):
     slug = models.SlugField(max_length=32, unique=True)
     subtitle = models.TextField(blank=True)
     site_url = models.URLField()
-    feed_url = models.URLField()
+    feed_url = models.URLField(unique=True)
     updated = models.DateTimeField()
     board = models.ForeignKey(Board, on_delete=models.SET_NULL, null=True)
+    refresh_interval = models.PositiveIntegerField(default=1800)
+    next_refresh_at = models.DateTimeField(null=True, blank=True)
+    failure_count = models.PositiveIntegerField(default=0)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    # position of the newest stored entry for sources fetched incrementally (Telegram message id)
+    entry_cursor = models.CharField(max_length=64, blank=True)
+    unread_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-updated'], name='feed_updated_idx')
+        ]
 
     def __str__(self):
         return self.title
@@ -55,9 +79,14 @@ class Feed(models.Model):
     def add_feed(title, subtitle, site_url, feed_url, board):
         existing_feed = Feed.objects.filter(feed_url=feed_url).first()
         if existing_feed:
+            if not existing_feed.site_url and site_url:
+                # created from boards.yml, the first refresh tells where the site is
+                existing_feed.site_url = site_url
+                existing_feed.subtitle = subtitle
+                existing_feed.save(update_fields=['site_url', 'subtitle'])
             return existing_feed
         else:
-            slug = slugify(title)
+            slug = Feed.make_slug(title, feed_url, set(Feed.objects.values_list('slug', flat=True)))
             new_feed = Feed.objects.create(
                 title=title,
                 subtitle=subtitle,
@@ -65,10 +94,19 @@ class Feed(models.Model):
                 feed_url=feed_url,
                 board=board,
                 slug=slug,
-                updated=datetime.now()
+                updated=timezone.now()
             )
             return new_feed
 
+    @staticmethod
+    def make_slug(title, feed_url, taken_slugs):
+        # the slug of the title while it's free; feeds sharing a title (one per board) get a hash of their url appended
+        title_slug = slugify(title)[:32].strip('-')
+        if title_slug and title_slug not in taken_slugs:
+            return title_slug
+        url_hash = hashlib.sha1(feed_url.encode('utf-8')).hexdigest()[:8]
+        return f"{title_slug[:23].strip('-') or 'feed'}-{url_hash}"
+
     @staticmethod
     def get_feed_by_id(feed_id):
         return Feed.objects.filter(id=feed_id).first()
@@ -96,44 +134,246 @@ class Feed(models.Model):
     def get_first_feed_by_board(board):
         return Feed.objects.filter(board=board).first()
 
+    @staticmethod
+    def get_first_feed_slug_by_board_slug(board_slug):
+        return Feed.objects.filter(board__slug=board_slug).order_by('id').values_list('slug', flat=True).first()
+
     @staticmethod
     def get_feeds_by_board(board):
         return Feed.objects.filter(board=board).all()
 
+    @staticmethod
+    def get_validators_by_urls(urls):
+        feeds = Feed.objects.filter(feed_url__in=urls).values_list('feed_url', 'etag', 'last_modified', 'content_hash')
+        return {url: (etag, last_modified, content_hash) for url, etag, last_modified, content_hash in feeds}
+
+    @staticmethod
+    def set_validators(feed_url, validators, entry_cursor=None):
+        etag, last_modified, content_hash = validators
+        fields = {'etag': etag, 'last_modified': last_modified, 'content_hash': content_hash}
+        if entry_cursor is not None:
+            fields['entry_cursor'] = entry_cursor
+        return Feed.objects.filter(feed_url=feed_url).update(**fields)
+
+    @staticmethod
+    def get_entry_cursors_by_urls(urls):
+        return dict(Feed.objects.filter(feed_url__in=urls).exclude(entry_cursor='').values_list('feed_url', 'entry_cursor'))
+
+    @staticmethod
+    def change_unread_count(feed_id, delta):
+        # called inside the transaction that changed the articles, F() keeps concurrent updates correct
+        Feed.objects.filter(pk=feed_id).update(unread_count=models.F('unread_count') + delta)
+        Board.objects.filter(feed=feed_id).update(unread_count=models.F('unread_count') + delta)
+
+    @staticmethod
+    def rebuild_unread_counts():
+        # recounts everything in one aggregate query over the unread articles; the count and the
+        # write share one transaction, which takes the write lock first, so no change slips in between
+        with transaction.atomic():
+            unread_by_feed = dict(
+                Article.objects.filter(is_read=False).order_by().values_list('feed').annotate(models.Count('id'))
+            )
+            feeds = list(Feed.objects.only('id', 'board_id', 'unread_count'))
+            unread_by_board = {}
+            for feed in feeds:
+                feed.unread_count = unread_by_feed.get(feed.id, 0)
+                unread_by_board[feed.board_id] = unread_by_board.get(feed.board_id, 0) + feed.unread_count
+            boards = list(Board.objects.only('id', 'unread_count'))
+            for board in boards:
+                board.unread_count = unread_by_board.get(board.id, 0)
+
+            Feed.objects.bulk_update(feeds, ['unread_count'])
+            Board.objects.bulk_update(boards, ['unread_count'])
+        return len(feeds), len(boards)
+
 
 class Article(models.Model):
     id = models.AutoField(primary_key=True)
     title = models.CharField(max_length=255)
-    slug = models.SlugField(max_length=32, unique=True)
+    slug = models.SlugField(max_length=64)
+    # sha1 of the entry guid (or link), identifies the article within its feed
+    guid_hash = models.CharField(max_length=40, null=True)
     description = models.TextField(blank=True)
     url = models.URLField()
     published = models.DateTimeField()
     thumbnail = models.ImageField(upload_to='thumbnails/', blank=True)
     is_read = models.BooleanField(default=False)
-    feed = models.ForeignKey(Feed, on_delete=models.CASCADE)
+    # the composite indexes below all start with feed, so the FK doesn't need its own index
+    feed = models.ForeignKey(Feed, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['feed', 'guid_hash'], name='unique_article_guid_per_feed')
+        ]
+        indexes = [
+            models.Index(fields=['feed', '-published', '-id'], name='article_feed_published_idx'),
+            # is_read=False compiles to NOT is_read on SQLite, which a column of an index can't
+            # serve; partial indexes over the unread articles can, and stay small
+            models.Index(
+                fields=['feed', '-published', '-id'], condition=models.Q(is_read=False), name='article_feed_unread_idx'
+            ),
+            models.Index(fields=['-published', '-id'], condition=models.Q(is_read=False), name='article_unread_idx')
+        ]
 
     def __str__(self):
         return self.title
 
     @staticmethod
-    def add_article(title, description, url, feed, published, thumbnail):
-        slug = slugify(title)
-        existing_article = Article.objects.filter(slug=slug).first()
+    def make_guid_hash(guid, url, title):
+        identity = guid or url or title
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def make_slug(title, guid_hash):
+        # slugs only have to be readable and unique within a feed, the hash suffix takes care of the latter
+        title_slug = slugify(title)[:48].strip('-')
+        if not title_slug:
+            return guid_hash[:8]
+        return f"{title_slug}-{guid_hash[:8]}"
+
+    @staticmethod
+    def add_article(title, description, url, feed, published, thumbnail, guid=None):
+        guid_hash = Article.make_guid_hash(guid, url, title)
+        existing_article = Article.objects.filter(feed=feed, guid_hash=guid_hash).first()
         if existing_article:
             return existing_article
         else:
-            new_article = Article.objects.create(
-                title=title,
-                slug=slug,
-                description=description,
-                url=url,
-                feed=feed,
-                published=published,
-                thumbnail=thumbnail,
-                is_read=False
-            )
+            with transaction.atomic():
+                new_article = Article.objects.create(
+                    title=title,
+                    slug=Article.make_slug(title, guid_hash),
+                    guid_hash=guid_hash,
+                    description=description,
+                    url=url,
+                    feed=feed,
+                    published=published,
+                    thumbnail=thumbnail,
+                    is_read=False
+                )
+                Feed.change_unread_count(feed.id, 1)
+                search.index_articles([new_article])
             return new_article
 
+    @staticmethod
+    def add_articles(feed, entries, update=False):
+        # Batch version of add_article: one indexed query for existing guids, one bulk insert,
+        # and optionally one bulk update of articles whose fields changed.
+        counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+        entries_by_hash = {}
+        for entry in entries:
+            guid_hash = Article.make_guid_hash(entry.get('guid'), entry['url'], entry['title'])
+            entries_by_hash.setdefault(guid_hash, entry)
+        counts['skipped'] += len(entries) - len(entries_by_hash)
+
+        with transaction.atomic():
+            existing_articles = {
+                article.guid_hash: article
+                for article in Article.objects.filter(feed=feed, guid_hash__in=entries_by_hash)
+            }
+            # articles removed by the retention policy stay removed while the source still lists them
+            pruned_hashes = PrunedArticle.get_pruned_hashes(
+                feed, [guid_hash for guid_hash in entries_by_hash if guid_hash not in existing_articles]
+            )
+
+            new_articles = [
+                Article(
+                    title=entry['title'],
+                    slug=Article.make_slug(entry['title'], guid_hash),
+                    guid_hash=guid_hash,
+                    description=entry['description'],
+                    url=entry['url'],
+                    feed=feed,
+                    published=entry['published'],
+                    thumbnail=entry['thumbnail'],
+                    is_read=False
+                )
+                for guid_hash, entry in entries_by_hash.items()
+                if guid_hash not in existing_articles and guid_hash not in pruned_hashes
+            ]
+            Article.objects.bulk_create(new_articles)
+            counts['inserted'] = len(new_articles)
+            if new_articles:
+                Feed.change_unread_count(feed.id, len(new_articles))
+            if new_articles and new_articles[0].pk is None:
+                # backends that can't return ids from a bulk insert
+                new_articles = list(Article.objects.filter(
+                    feed=feed,
+                    guid_hash__in=[article.guid_hash for article in new_articles]
+                ))
+
+            changed_articles = []
+            for guid_hash, article in existing_articles.items():
+                entry = entries_by_hash[guid_hash]
+                if not update:
+                    continue
+                if any(getattr(article, field) != entry[field] for field in ARTICLE_ENTRY_FIELDS):
+                    for field in ARTICLE_ENTRY_FIELDS:
+                        setattr(article, field, entry[field])
+                    changed_articles.append(article)
+            Article.objects.bulk_update(changed_articles, ARTICLE_ENTRY_FIELDS)
+            counts['updated'] = len(changed_articles)
+            search.index_articles(new_articles + changed_articles)
+
+        counts['skipped'] += len(existing_articles) - counts['updated'] + len(pruned_hashes)
+        return counts
+
+    @staticmethod
+    def backfill_guid_hashes(batch_size=1000):
+        # Articles stored before guid_hash existed have it NULL, which the unique constraint ignores,
+        # so every entry still listed by its source would be stored again. Old rows never kept the
+        # guid, so they are keyed by url the way entries without a guid are. A second row with the
+        # same url in the same feed stays NULL rather than break the constraint.
+        updated = duplicates = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                articles = list(
+                    Article.objects.filter(guid_hash__isnull=True, id__gt=last_id)
+                    .only('id', 'feed_id', 'url', 'title')
+                    .order_by('id')[:batch_size]
+                )
+                if not articles:
+                    return updated, duplicates
+                last_id = articles[-1].id
+                for article in articles:
+                    article.guid_hash = Article.make_guid_hash(None, article.url, article.title)
+                taken = set(Article.objects.filter(
+                    feed_id__in={article.feed_id for article in articles},
+                    guid_hash__in={article.guid_hash for article in articles}
+                ).values_list('feed_id', 'guid_hash'))
+                changed_articles = []
+                for article in articles:
+                    if (article.feed_id, article.guid_hash) in taken:
+                        duplicates += 1
+                        continue
+                    taken.add((article.feed_id, article.guid_hash))
+                    changed_articles.append(article)
+                Article.objects.bulk_update(changed_articles, ['guid_hash'])
+                updated += len(changed_articles)
+
+    @staticmethod
+    def get_recent_guid_hashes(feed_urls, limit):
+        # guid hashes of the newest articles of every feed; one short query per feed walks the
+        # (feed, -published, -id) index and stops after limit rows, however long the history is
+        guid_hashes = {}
+        for feed_id, feed_url in Feed.objects.filter(feed_url__in=feed_urls).values_list('id', 'feed_url'):
+            guid_hashes[feed_url] = set(
+                Article.objects.filter(feed_id=feed_id)
+                .order_by('-published', '-id')
+                .values_list('guid_hash', flat=True)[:limit]
+            )
+        return guid_hashes
+
+    @staticmethod
+    def get_ids_without_thumbnail(feed, guid_hashes):
+        articles = Article.objects.filter(feed=feed, guid_hash__in=guid_hashes, thumbnail='')
+        return dict(articles.values_list('guid_hash', 'id'))
+
+    @staticmethod
+    def set_thumbnails(thumbnails):
+        articles = [Article(id=article_id, thumbnail=thumbnail) for article_id, thumbnail in thumbnails.items()]
+        Article.objects.bulk_update(articles, ['thumbnail'])
+
     @staticmethod
     def get_last_articles(feed, limit):
         if limit <= 0:
@@ -149,23 +389,283 @@ class Article(models.Model):
             return None
 
     @staticmethod
-    def get_article_by_slug(slug):
-        try:
-            return Article.objects.get(slug=slug)
-        except Article.DoesNotExist:
-            return None
+    def get_article_by_slug(slug, feed_slug=None):
+        articles = Article.objects.filter(slug=slug)
+        if feed_slug is not None:
+            articles = articles.filter(feed__slug=feed_slug)
+        return articles.first()
 
     @staticmethod
     def set_article_as_read(article):
         if article:
-            article.is_read = True
-            article.save()
+            if not article.is_read:
+                with transaction.atomic():
+                    if Article.objects.filter(pk=article.pk, is_read=False).update(is_read=True):
+                        Feed.change_unread_count(article.feed_id, -1)
+                article.is_read = True
             return True
         return False
 
+    @staticmethod
+    def mark_as_read(articles):
+        # One set-based UPDATE for the whole queryset. The unread counters are lowered per
+        # affected feed, counted in the same transaction. Returns {feed id: articles marked}.
+        unread_articles = articles.filter(is_read=False)
+        with transaction.atomic():
+            unread_by_feed = dict(unread_articles.order_by().values_list('feed').annotate(models.Count('id')))
+            if unread_by_feed:
+                unread_articles.update(is_read=True)
+            for feed_id, count in unread_by_feed.items():
+                Feed.change_unread_count(feed_id, -count)
+        return unread_by_feed
+
+    @staticmethod
+    def mark_feed_as_read(feed_slug):
+        return Article.mark_as_read(Article.get_feed_articles(feed_slug))
+
+    @staticmethod
+    def mark_board_as_read(board_slug):
+        return Article.mark_as_read(Article.get_board_articles(board_slug))
+
+    @staticmethod
+    def mark_older_as_read(days):
+        published_before = timezone.now() - timedelta(days=days)
+        return Article.mark_as_read(Article.objects.filter(published__lt=published_before))
+
+    @staticmethod
+    def mark_ids_as_read(article_ids):
+        return Article.mark_as_read(Article.objects.filter(id__in=article_ids))
+
     @staticmethod
     def get_articles_by_feed(feed, limit=None):
         articles = Article.objects.filter(feed=feed).order_by('-published')
         if limit is not None:
             articles = articles[:limit]
         return articles
+
+    @staticmethod
+    def encode_cursor(article):
+        value = f"{article.published.isoformat()}|{article.id}"
+        return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        # raises ValueError for anything that isn't a cursor made by encode_cursor
+        try:
+            value = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        except (UnicodeError, binascii.Error):
+            raise ValueError("Неверный курсор")
+        published, _, article_id = value.rpartition('|')
+        return datetime.fromisoformat(published), int(article_id)
+
+    @staticmethod
+    def get_page(articles, cursor=None, limit=30):
+        # Keyset pagination on (published, id), newest first: every page is an index range scan
+        # starting right after the cursor, no matter how deep it is. Returns the page and the
+        # cursor of the next one (None on the last page).
+        articles = articles.order_by('-published', '-id')
+        if cursor:
+            published, article_id = Article.decode_cursor(cursor)
+            articles = articles.filter(
+                models.Q(published__lt=published) | models.Q(published=published, id__lt=article_id)
+            )
+        page = list(articles[:limit + 1])
+        next_cursor = Article.encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return page[:limit], next_cursor
+
+    @staticmethod
+    def get_feed_articles(feed_slug):
+        return Article.objects.filter(feed__slug=feed_slug)
+
+    @staticmethod
+    def get_board_articles(board_slug):
+        return Article.objects.filter(feed__board__slug=board_slug)
+
+    @staticmethod
+    def get_unread_articles():
+        return Article.objects.filter(is_read=False)
+
+
+class PrunedArticle(models.Model):
+    # Guid hashes of the articles deleted by the retention policy. Dedup only sees stored
+    # articles, so without these a source that still lists a pruned entry would bring it back
+    # as a new unread article on the next refresh.
+    id = models.AutoField(primary_key=True)
+    feed = models.ForeignKey(Feed, on_delete=models.CASCADE, db_index=False)
+    guid_hash = models.CharField(max_length=40)
+    pruned = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['feed', 'guid_hash'], name='unique_pruned_guid_per_feed')
+        ]
+        indexes = [
+            models.Index(fields=['pruned'], name='pruned_article_pruned_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.feed_id} {self.guid_hash}'
+
+    @staticmethod
+    def add_pruned(feed_id, guid_hashes):
+        PrunedArticle.objects.bulk_create(
+            [PrunedArticle(feed_id=feed_id, guid_hash=guid_hash) for guid_hash in guid_hashes if guid_hash],
+            ignore_conflicts=True
+        )
+
+    @staticmethod
+    def get_pruned_hashes(feed, guid_hashes):
+        if not guid_hashes:
+            return set()
+        return set(PrunedArticle.objects.filter(feed=feed, guid_hash__in=guid_hashes).values_list('guid_hash', flat=True))
+
+    @staticmethod
+    def delete_older_than(days):
+        return PrunedArticle.objects.filter(pruned__lt=timezone.now() - timedelta(days=days)).delete()[0]
+
+
+class FetchLog(models.Model):
+    # One row per source per refresh. Times are in seconds: ttfb runs from sending the request
+    # until the response headers arrived (DNS, connect, TLS and server time together),
+    # download is reading the body, db is storing the articles.
+    id = models.AutoField(primary_key=True)
+    title = models.CharField(max_length=255)
+    feed_url = models.URLField()
+    started = models.DateTimeField()
+    status = models.PositiveSmallIntegerField(null=True)
+    bytes = models.PositiveIntegerField(default=0)
+    ttfb = models.FloatField(default=0)
+    download_time = models.FloatField(default=0)
+    parse_time = models.FloatField(default=0)
+    db_time = models.FloatField(default=0)
+    total_time = models.FloatField(default=0)
+    entries_seen = models.PositiveIntegerField(default=0)
+    entries_inserted = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['feed_url', '-id'], name='fetchlog_feed_idx'),
+            models.Index(fields=['started'], name='fetchlog_started_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.title} {self.started:%Y-%m-%d %H:%M}'
+
+    @staticmethod
+    def add_logs(metrics):
+        FetchLog.objects.bulk_create([FetchLog(**fields) for fields in metrics])
+
+    @staticmethod
+    def get_latest_logs():
+        # the last refresh of every source
+        latest_ids = FetchLog.objects.values('feed_url').annotate(last_id=models.Max('id')).values('last_id')
+        return FetchLog.objects.filter(id__in=latest_ids).order_by('title')
+
+    @staticmethod
+    def delete_older_than(days):
+        return FetchLog.objects.filter(started__lt=timezone.now() - timedelta(days=days)).delete()[0]
+
+
+class RefreshJob(models.Model):
+    # A refresh of every feed requested from the web page. The view only creates the job,
+    # the refresh worker picks it up and writes one RefreshJobEvent per feed as it goes.
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = ((PENDING, PENDING), (RUNNING, RUNNING), (DONE, DONE), (FAILED, FAILED))
+
+    id = models.AutoField(primary_key=True)
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+    total = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'{self.id} {self.status}'
+
+    @property
+    def is_finished(self):
+        return self.status in (RefreshJob.DONE, RefreshJob.FAILED)
+
+    @staticmethod
+    def get_or_create_job(timeout):
+        # a job that is still waiting or running already covers a new request
+        with transaction.atomic():
+            RefreshJob.fail_stale_jobs(timeout)
+            job = RefreshJob.objects.filter(status__in=(RefreshJob.PENDING, RefreshJob.RUNNING)).order_by('id').first()
+            if job is None:
+                job = RefreshJob.objects.create()
+        return job
+
+    @staticmethod
+    def fail_stale_jobs(timeout):
+        # a worker killed outright can't finish its job, it is given up after timeout seconds
+        now = timezone.now()
+        return RefreshJob.objects.filter(
+            status=RefreshJob.RUNNING,
+            started__lt=now - timedelta(seconds=timeout)
+        ).update(status=RefreshJob.FAILED, finished=now, error='refresh worker stopped')
+
+    @staticmethod
+    def has_pending_job():
+        return RefreshJob.objects.filter(status=RefreshJob.PENDING).exists()
+
+    @staticmethod
+    def claim_pending_job():
+        # the conditional update makes sure only one worker runs a job
+        for job in RefreshJob.objects.filter(status=RefreshJob.PENDING).order_by('id'):
+            claimed = RefreshJob.objects.filter(pk=job.pk, status=RefreshJob.PENDING).update(
+                status=RefreshJob.RUNNING,
+                started=timezone.now()
+            )
+            if claimed:
+                return RefreshJob.objects.get(pk=job.pk)
+        return None
+
+    @staticmethod
+    def set_total(job_id, total):
+        RefreshJob.objects.filter(pk=job_id).update(total=total)
+
+    @staticmethod
+    def finish(job_id, error=''):
+        RefreshJob.objects.filter(pk=job_id).update(
+            status=RefreshJob.FAILED if error else RefreshJob.DONE,
+            finished=timezone.now(),
+            error=error
+        )
+
+    @staticmethod
+    def delete_older_than(days):
+        # events go with their job
+        return RefreshJob.objects.filter(created__lt=timezone.now() - timedelta(days=days)).delete()[0]
+
+
+class RefreshJobEvent(models.Model):
+    # the result of one feed within a refresh job, the id doubles as the SSE event id
+    id = models.AutoField(primary_key=True)
+    job = models.ForeignKey(RefreshJob, on_delete=models.CASCADE, related_name='events')
+    title = models.CharField(max_length=255)
+    inserted = models.PositiveIntegerField(default=0)
+    unchanged = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'{self.job_id} {self.title}'
+
+    @staticmethod
+    def add_result(job_id, result):
+        return RefreshJobEvent.objects.create(
+            job_id=job_id,
+            title=result['source']['title'],
+            inserted=result['inserted'],
+            unchanged=result['unchanged'],
+            error=str(result['error'] or '')
+        )
+
+    @staticmethod
+    def get_events_after(job_id, event_id):
+        return RefreshJobEvent.objects.filter(job_id=job_id, id__gt=event_id).order_by('id')
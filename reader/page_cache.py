@@ -0,0 +1,61 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Feed
+
+# Rendered fragments are cached under keys that include a generation number. Changing data
+# bumps the generation, after which the old fragments are never read again and expire.
+#   boards generation          -> header board list and the board shown on the index page
+#   board generation (by slug) -> sidebar feed list, first feed of the board, feed title block
+#   feed generation (by slug)  -> article list of the feed
+
+
+def boards_key():
+    return 'rune:generation:boards'
+
+
+def board_key(board_slug):
+    return f'rune:generation:board:{board_slug}'
+
+
+def feed_key(feed_slug):
+    return f'rune:generation:feed:{feed_slug}'
+
+
+def get_generation(key):
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(key):
+    cache.set(key, time.time_ns(), None)
+
+
+def get_or_set(key, compute):
+    return cache.get_or_set(f'rune:{key}', compute, settings.PAGE_CACHE_TIMEOUT)
+
+
+def invalidate_boards():
+    bump_generation(boards_key())
+
+
+def invalidate_board(board_slug):
+    bump_generation(board_key(board_slug))
+
+
+def invalidate_feed(feed_slug):
+    bump_generation(feed_key(feed_slug))
+
+
+def invalidate_feeds_by_id(feed_ids):
+    # after changes that span many feeds, e.g. bulk read state updates
+    feeds = Feed.objects.filter(id__in=feed_ids).values_list('slug', 'board__slug')
+    for feed_slug, board_slug in feeds:
+        invalidate_feed(feed_slug)
+        invalidate_board(board_slug)
+    invalidate_boards()
@@ -1,165 +1,246 @@
 import feedparser
 import json
-import pytz
+import re
 
 from bs4 import BeautifulSoup
-from datetime import datetime, timedelta
+from itertools import chain
+from lxml import etree
+from lxml import html as lxml_html
 
-from .models import Feed, Article, Board
-from .utils import check_file_size, download, download_json, truncate_string_by_dot, get_base_url
-from .utils import transform_telegram_url_to_web_url, get_first_sentence, extract_background_image_url
+from django.utils import timezone
 
-USER_UTC = 4
-USER_TIMEZONE = 'Europe/Saratov'
+from .dates import parse_datetime
+from .utils import download, get_base_url
+from .utils import extract_background_image_url, get_inner_html, process_element, process_html
 
 TELEGRAM_CHANNEL_WEBVIEW_PREFIX = "https://t.me/s/"
 
-TELEGRAM_MESSAGE_CLASS = ".tgme_widget_message"
-TELEGRAM_MESSAGE_TEXT_CLASS = ".tgme_widget_message_text"
-TELEGRAM_MESSAGE_PHOTO_CLASS = ".tgme_widget_message_photo_wrap"
-TELEGRAM_MESSAGE_DATE_CLASS = ".tgme_widget_message_date"
+TELEGRAM_MESSAGE_CLASS = "tgme_widget_message"
+TELEGRAM_MESSAGE_TEXT_CLASS = "tgme_widget_message_text"
+TELEGRAM_MESSAGE_PHOTO_CLASS = "tgme_widget_message_photo_wrap"
+TELEGRAM_MESSAGE_DATE_CLASS = "tgme_widget_message_date"
 
-DATETIME_PATTERNS = [
-    '%Y-%m-%dT%H:%M:%S.%f',
-    '%Y-%m-%dT%H:%M:%S',
-    '%a, %d %b %Y %H:%M:%S %z'
-    '%a, %d %b %Y %H:%M:%S %Z',
-    '%d-%m-%y'
-]
+TELEGRAM_MESSAGE_ID_PATTERN = re.compile(rb'data-post="[^"]*/(\d+)"')
 
+ATOM_NAMESPACE = 'http://www.w3.org/2005/Atom'
+MEDIA_NAMESPACE = 'http://search.yahoo.com/mrss/'
 
-def get_rss(url):
-    feed = feedparser.parse(url)
+def get_rss(content):
+    feed = feedparser.parse(content)
     return feed
 
 
-def parse_rss(feed, feed_title, board_title):
-    # add feed
-    new_feed = Feed.add_feed(
-        feed_title,
-        feed.feed.subtitle,
-        feed.feed.link,
-        feed.href,
-        Board.get_board_by_title(board_title)
-    )
+def parse_rss(feed, feed_title):
+    feed_data = {
+        'title': feed_title,
+        'subtitle': feed.feed.get('subtitle', ''),
+        'site_url': feed.feed.get('link', feed.get('href', ''))
+    }
+    return feed_data, iter_rss_entries(feed, feed_title)
 
-    # add feed articles
+
+def iter_rss_entries(feed, feed_title, stop_at=None):
     for entry in feed.entries:
-        soup = BeautifulSoup(entry.description, "html.parser")
-        description = soup.get_text()
-        thumbnail = get_thumbnail(entry)
-        if 'published' in entry:
-            published = convert_to_datetime(entry.published)
+        article = make_rss_article(entry, feed_title)
+        if stop_at is not None and stop_at(article):
+            return
+        yield article
+
+
+def make_rss_article(entry, feed_title):
+    # entry is a feedparser entry or a dict with the same keys built by read_stream_entry
+    processed_description = process_html(entry.get('description', ''))
+    description = processed_description['text']
+    thumbnail, thumbnail_candidates = get_thumbnail(entry, processed_description['images'])
+    if 'published' in entry:
+        published = parse_datetime(entry['published'], feed_title)
+    else:
+        published = timezone.now()
+    return {
+        'title': entry.get('title', ''),
+        'description': description,
+        'url': entry.get('link', ''),
+        'guid': entry.get('id') or entry.get('link', ''),
+        'published': published,
+        'thumbnail': thumbnail,
+        'thumbnail_candidates': thumbnail_candidates
+    }
+
+
+def parse_rss_stream(chunks, feed_title, stop_at=None):
+    # feed_data is filled from the channel header while the entries are read
+    feed_data = {
+        'title': feed_title,
+        'subtitle': '',
+        'site_url': ''
+    }
+    return feed_data, iter_rss_stream(chunks, feed_data, stop_at)
+
+
+def iter_rss_stream(chunks, feed_data, stop_at):
+    # RSS and Atom entries are built while the document is still downloading, and every item is
+    # dropped from the tree once read, so memory doesn't grow with the feed. Reading stops before
+    # the first entry stop_at() accepts, the refresh pipeline decides where the stored ones begin.
+    # Documents the pull parser finds no entries in go to feedparser instead.
+    parser = etree.XMLPullParser(events=('end',), recover=True, resolve_entities=False, no_network=True)
+    # the downloaded bytes are kept only until the first entry, for the fallback
+    buffered = []
+    try:
+        # None closes the parser, which flushes the events of the last bytes
+        for chunk in chain(chunks, [None]):
+            if buffered is not None and chunk is not None:
+                buffered.append(chunk)
+            try:
+                if chunk is None:
+                    parser.close()
+                else:
+                    parser.feed(chunk)
+            except etree.XMLSyntaxError:
+                break
+            for _, element in parser.read_events():
+                name = etree.QName(element).localname
+                if name in ('item', 'entry'):
+                    buffered = None
+                    article = make_rss_article(read_stream_entry(element), feed_data['title'])
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+                    if stop_at is not None and stop_at(article):
+                        return
+                    yield article
+                elif element.getparent() is not None and etree.QName(element.getparent()).localname in ('channel', 'feed'):
+                    read_stream_header(element, name, feed_data)
+    finally:
+        close_chunks = getattr(chunks, 'close', None)
+        if close_chunks is not None:
+            close_chunks()
+
+    if buffered:
+        feed = get_rss(b''.join(buffered))
+        feed_data['subtitle'] = feed.feed.get('subtitle', '')
+        feed_data['site_url'] = feed.feed.get('link', '')
+        yield from iter_rss_entries(feed, feed_data['title'], stop_at)
+
+
+def read_stream_header(element, name, feed_data):
+    if name in ('description', 'subtitle') and not feed_data['subtitle']:
+        feed_data['subtitle'] = (element.text or '').strip()
+    elif name == 'link' and not feed_data['site_url']:
+        if etree.QName(element).namespace == ATOM_NAMESPACE:
+            if element.get('rel', 'alternate') == 'alternate':
+                feed_data['site_url'] = element.get('href', '')
         else:
-            published = datetime.now()
-        Article.add_article(
-            entry.title,
-            description,
-            entry.link,
-            new_feed,
-            published,
-            thumbnail
-        )
-
-
-def get_thumbnail(entry):
-    # searching for first large image
-    # 1. searching in description
-    if '<img' in entry.description:
-        soup = BeautifulSoup(entry.description, 'html.parser')
-        img_tag = soup.find('img')
-        return img_tag.get('src')
-    # 2. searching in content
+            feed_data['site_url'] = (element.text or '').strip()
+
+
+def read_stream_entry(element):
+    # the subset of feedparser's entry keys the article is made from
+    entry = {'media_thumbnail': [], 'media_content': [], 'enclosures': [], 'content': []}
+    children = list(element)
+    for child in children:
+        if not isinstance(child.tag, str):
+            continue
+        qname = etree.QName(child)
+        name = qname.localname
+        text = (child.text or '').strip()
+        if qname.namespace == MEDIA_NAMESPACE:
+            if name == 'group':
+                children.extend(child)
+            elif name == 'thumbnail':
+                entry['media_thumbnail'].append({'url': child.get('url', '')})
+            elif name == 'content':
+                entry['media_content'].append(dict(child.attrib))
+        elif name == 'title':
+            entry['title'] = text
+        elif name in ('description', 'summary'):
+            entry['description'] = get_inner_html(child) if len(child) else child.text or ''
+        elif name == 'encoded' or (name == 'content' and qname.namespace == ATOM_NAMESPACE):
+            entry['content'].append({'value': get_inner_html(child) if len(child) else child.text or ''})
+        elif name == 'link':
+            if qname.namespace != ATOM_NAMESPACE:
+                entry['link'] = text
+            elif child.get('rel', 'alternate') == 'alternate' and 'link' not in entry:
+                entry['link'] = child.get('href', '')
+        elif name in ('guid', 'id'):
+            entry['id'] = text
+        elif name in ('pubDate', 'published', 'date') and text:
+            entry['published'] = text
+        elif name == 'updated' and text:
+            entry.setdefault('published', text)
+        elif name == 'enclosure':
+            entry['enclosures'].append({'href': child.get('url', ''), 'type': child.get('type', '')})
+    if 'description' not in entry and entry['content']:
+        entry['description'] = entry['content'][0]['value']
+    if not entry['content']:
+        del entry['content']
+    return entry
+
+
+def get_thumbnail(entry, description_images):
+    # Returns the thumbnail and a list of candidate images. Candidates are only filled
+    # when the feed doesn't name a thumbnail itself, they are probed after ingestion.
+    # 1. media:thumbnail, media:content and image enclosures
+    for media_thumbnail in entry.get('media_thumbnail', []):
+        if media_thumbnail.get('url'):
+            return media_thumbnail['url'], []
+    for media_content in entry.get('media_content', []):
+        is_image = media_content.get('medium') == 'image' or media_content.get('type', '').startswith('image/')
+        if media_content.get('url') and is_image:
+            return media_content['url'], []
+    for enclosure in entry.get('enclosures', []):
+        if enclosure.get('href') and enclosure.get('type', '').startswith('image/'):
+            return enclosure['href'], []
+    # 2. searching in description
+    if description_images:
+        return description_images[0], []
+    # 3. searching in content, the first image larger than 10 kbytes wins
+    candidates = []
     if 'content' in entry:
-        # print(entry.content[0].value)
-        soup = BeautifulSoup(entry.content[0].value, 'html.parser')
-        img_tags = soup.find_all('img')
-
-        # searching image that has size more that 10 kbytes in img tags
-        for img_tag in img_tags:
-            img_src = img_tag.get('src')
-            if "data:" not in img_src and check_file_size(img_src):
-                return img_src
-    return ''
-
-
-def convert_to_datetime(datetime_string):
-    datetime_format1 = '%a, %d %b %Y %H:%M:%S %z'
-    datetime_format2 = '%a, %d %b %Y %H:%M:%S %Z'
-
-    try:
-        raw_datetime = datetime.strptime(datetime_string, datetime_format1)
-    except ValueError:
-        try:
-            raw_datetime = datetime.strptime(datetime_string, datetime_format2)
-        except ValueError:
-            raise ValueError("Неверный формат даты")
-
-    if raw_datetime.tzinfo is None:
-        aware_datetime = raw_datetime.replace(tzinfo=pytz.timezone(USER_TIMEZONE))
-    else:
-        aware_datetime = raw_datetime
-    delta = timedelta(hours=USER_UTC)
-    final_datetime = aware_datetime + delta
-
-    return final_datetime
-
+        for img_src in process_html(entry['content'][0]['value'])['images']:
+            if "data:" not in img_src:
+                candidates.append(img_src)
+    return '', candidates
 
-def convert_to_datetime_tj(str_date):
-    datetime_format = '%d-%m-%y'
-    return datetime.strptime(str_date, datetime_format)
 
-
-def convert_to_datetime_kanobu(str_date):
-    # "%Y-%m-%dT%H:%M:%S.%f"
-    datetime_format = '%Y-%m-%dT%H:%M:%S%z'
-    return datetime.strptime(str_date, datetime_format)
-
-
-def parse_kanobu(feed_url, site_url, feed_title, board_title):
+def parse_kanobu(kanobu_data, site_url, feed_title):
     # https://www.igromania.ru/api/v3/articles/?limit=20
-    # kanobu_data = get_kanobu_json(url)
-    kanobu_data = download_json(feed_url)
+    feed_data = {
+        'title': feed_title,
+        'subtitle': '',
+        'site_url': site_url
+    }
+    return feed_data, iter_kanobu_entries(kanobu_data, site_url, feed_title)
 
-    new_feed = Feed.add_feed(
-        feed_title,
-        '',
-        site_url,
-        feed_url,
-        Board.get_board_by_title(board_title)
-    )
 
-    articles = kanobu_data['results']
-
-    for article in articles:
+def iter_kanobu_entries(kanobu_data, site_url, feed_title):
+    for article in kanobu_data['results']:
         if 'desc' in article:
             article_description = article['desc']
         else:
             article_description = ''
 
-        pubdate = truncate_string_by_dot(article['pubdate'])
+        yield {
+            'title': article['title'],
+            'description': article_description,
+            'url': f"{site_url}{article['slug']}",
+            'guid': article['slug'],
+            'published': parse_datetime(article['pubdate'], feed_title),
+            'thumbnail': article['pic']['origin'] or ''
+        }
 
-        Article.add_article(
-            article['title'],
-            article_description,
-            f"{site_url}{article['slug']}",
-            new_feed,
-            convert_to_datetime_kanobu(pubdate),
-            article['pic']['origin'] or ''
-        )
 
+def parse_tj(raw_content, url, feed_title):
+    tj = get_tj_json(raw_content)
 
-def parse_tj(url, feed_title, board_title):
-    tj = get_tj_json(url)
+    feed_data = {
+        'title': feed_title,
+        'subtitle': tj['description'],
+        'site_url': url
+    }
+    return feed_data, iter_tj_entries(tj, url, feed_title)
 
-    new_feed = Feed.add_feed(
-        feed_title,
-        tj['description'],
-        url,
-        url,
-        Board.get_board_by_title(board_title)
-    )
 
+def iter_tj_entries(tj, url, feed_title):
     for card in tj['cards']:
         article = card['article']
         # previous tj api: article_url = f"{url[:-1]}{article['path']}"
@@ -170,14 +251,14 @@ def parse_tj(url, feed_title, board_title):
         else:
             article_thumbnail = card['media']['backgroundImage']['files']['original']['filepath']
 
-        Article.add_article(
-            article['title'],
-            article_description,
-            article_url,
-            new_feed,
-            convert_to_datetime_tj(article['date_published']),
-            article_thumbnail
-        )
+        yield {
+            'title': article['title'],
+            'description': article_description,
+            'url': article_url,
+            'guid': article['path'],
+            'published': parse_datetime(article['date_published'], feed_title),
+            'thumbnail': article_thumbnail
+        }
 
 
 def get_kanobu_json(url):
@@ -192,8 +273,7 @@ def get_kanobu_json(url):
     return json_data
 
 
-def get_tj_json(url):
-    raw_content = download(url)
+def get_tj_json(raw_content):
     soup = BeautifulSoup(raw_content, "html.parser")
     hidden_json_content = soup.find('script', {'type': 'application/json', 'data-id': 'flow-page'})
     json_data = json.loads(hidden_json_content.string)
@@ -201,51 +281,70 @@ def get_tj_json(url):
     return json_data
 
 
-def parse_telegram(url, channel_name, board_title, limit=100):
-    web_url = transform_telegram_url_to_web_url(url)
-    raw_content = download(web_url)
+def by_class(class_name):
+    # xpath for descendants with the class, lxml has no CSS selectors without cssselect
+    return f".//*[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+
+
+def get_telegram_message_id(data_post):
+    # data-post is "<channel>/<message id>"
+    message_id = data_post.rpartition('/')[2]
+    return int(message_id) if message_id.isdigit() else 0
+
+
+def get_last_telegram_message_id(raw_content):
+    # the newest message id on a page, without parsing it
+    message_ids = [int(message_id) for message_id in TELEGRAM_MESSAGE_ID_PATTERN.findall(raw_content)]
+    return max(message_ids, default=0)
+
+
+def parse_telegram(raw_content, url, channel_name, after_id=0, limit=100):
+    feed_data = {
+        'title': channel_name,
+        'subtitle': '',
+        'site_url': url
+    }
+    return feed_data, iter_telegram_entries(raw_content, channel_name, after_id, limit)
 
-    soup = BeautifulSoup(raw_content, features="lxml")
 
-    new_feed = Feed.add_feed(
-        channel_name,
-        '',
-        url,
-        url,
-        Board.get_board_by_title(board_title)
-    )
+def iter_telegram_entries(raw_content, channel_name, after_id, limit):
+    # Fields are read straight from the element tree. Messages up to after_id are already stored.
+    root = lxml_html.document_fromstring(raw_content)
 
-    message_tags = soup.select(TELEGRAM_MESSAGE_CLASS)
     counter = 1
-    message_title = ''
-    for message_tag in message_tags:
-        message_html = message_tag.prettify()
-        message_text = None
-        message_text_tag = message_tag.select(TELEGRAM_MESSAGE_TEXT_CLASS)
+    for message_tag in root.xpath(by_class(TELEGRAM_MESSAGE_CLASS)):
+        data_post = message_tag.get('data-post', '')
+        if after_id and get_telegram_message_id(data_post) <= after_id:
+            continue
+
+        message_title = 'Без названия'
+        message_text = ''
+        message_text_tag = message_tag.xpath(by_class(TELEGRAM_MESSAGE_TEXT_CLASS))
         if message_text_tag:
-            message_text = message_text_tag[0].decode_contents()
-            message_title = get_first_sentence(message_text) or 'Без названия'
+            message_text = get_inner_html(message_text_tag[0])
+            message_title = process_element(message_text_tag[0])['first_sentence'] or 'Без названия'
 
-        message_photo = extract_background_image_url(message_html)
+        message_photo = ''
+        background_styles = message_tag.xpath('.//@style[contains(., "background-image")]')
+        if background_styles:
+            message_photo = extract_background_image_url(background_styles[0])
 
         message_url = None
-        message_time = datetime.utcnow()
-        message_date_tag = message_tag.select(TELEGRAM_MESSAGE_DATE_CLASS)
+        message_time = timezone.now()
+        message_date_tag = message_tag.xpath(by_class(TELEGRAM_MESSAGE_DATE_CLASS))
         if message_date_tag:
-            message_url = message_date_tag[0]["href"]
-            message_datetime_tag = message_date_tag[0].select("time")
+            message_url = message_date_tag[0].get("href")
+            message_datetime_tag = message_date_tag[0].xpath(".//time[@datetime]")
             if message_datetime_tag:
-                message_time = datetime.strptime(message_datetime_tag[0]["datetime"][:19], "%Y-%m-%dT%H:%M:%S")
-        delta = timedelta(hours=USER_UTC)
-        message_time_with_delta = message_time + delta
-        Article.add_article(
-            message_title,
-            message_text,
-            message_url,
-            new_feed,
-            message_time_with_delta,
-            message_photo
-        )
+                message_time = parse_datetime(message_datetime_tag[0].get("datetime"), channel_name)
+        yield {
+            'title': message_title,
+            'description': message_text,
+            'url': message_url,
+            'guid': data_post or message_url,
+            'published': message_time,
+            'thumbnail': message_photo
+        }
 
         counter += 1
         if counter > limit:
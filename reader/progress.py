@@ -0,0 +1,94 @@
+import asyncio
+import json
+import time
+
+from django.conf import settings
+
+from .models import RefreshJob, RefreshJobEvent
+
+
+def format_event(event, data, event_id=None):
+    # one Server-Sent Events message, data is sent as JSON
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def get_job_data(job, completed):
+    return {
+        'job': job.id,
+        'status': job.status,
+        'total': job.total,
+        'completed': completed,
+        'error': job.error
+    }
+
+
+def get_event_data(event):
+    return {
+        'title': event.title,
+        'inserted': event.inserted,
+        'unchanged': event.unchanged,
+        'error': event.error
+    }
+
+
+class EventStream:
+    # What one events stream has sent so far. Every poll reads the job before its new events,
+    # so once the job is finished no event can be missed. A reconnecting browser sends
+    # Last-Event-ID and only gets the events after it.
+    def __init__(self, last_event_id, completed):
+        self.last_event_id = last_event_id
+        self.completed = completed
+        self.last_sent = time.monotonic()
+        self.finished = False
+
+    def get_messages(self, job, events):
+        messages = []
+        for event in events:
+            self.completed += 1
+            self.last_event_id = event.id
+            data = {**get_event_data(event), 'completed': self.completed, 'total': job.total}
+            messages.append(format_event('feed', data, event.id))
+        if job.is_finished:
+            messages.append(format_event('done', get_job_data(job, self.completed)))
+            self.finished = True
+        elif messages:
+            self.last_sent = time.monotonic()
+        elif time.monotonic() - self.last_sent >= settings.REFRESH_EVENTS_KEEPALIVE:
+            # comment line, keeps proxies from closing an idle connection
+            messages.append(': ping\n\n')
+            self.last_sent = time.monotonic()
+        return messages
+
+
+async def stream_job_events(job_id, last_event_id=0):
+    # Polls the database for the results the refresh worker writes and sends them as they come.
+    # Served under ASGI, where the open stream doesn't hold a worker thread.
+    completed = await RefreshJobEvent.objects.filter(job_id=job_id, id__lte=last_event_id).acount()
+    stream = EventStream(last_event_id, completed)
+    while True:
+        job = await RefreshJob.objects.aget(pk=job_id)
+        events = [event async for event in RefreshJobEvent.get_events_after(job_id, stream.last_event_id)]
+        for message in stream.get_messages(job, events):
+            yield message
+        if stream.finished:
+            return
+        await asyncio.sleep(settings.REFRESH_EVENTS_POLL_INTERVAL)
+
+
+def iter_job_events(job_id, last_event_id=0):
+    # The same stream for WSGI servers, which can't send an async iterator before it is exhausted.
+    # Every open stream holds a worker thread there until its job is finished.
+    completed = RefreshJobEvent.objects.filter(job_id=job_id, id__lte=last_event_id).count()
+    stream = EventStream(last_event_id, completed)
+    while True:
+        job = RefreshJob.objects.get(pk=job_id)
+        events = list(RefreshJobEvent.get_events_after(job_id, stream.last_event_id))
+        yield from stream.get_messages(job, events)
+        if stream.finished:
+            return
+        time.sleep(settings.REFRESH_EVENTS_POLL_INTERVAL)
@@ -0,0 +1,450 @@
+import collections
+import django
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import page_cache
+from .models import Board, Feed, Article, FetchLog
+from .sources import get_adapter
+from .thumbnails import resolve_thumbnail
+from .utils import download_if_modified, iter_response
+
+NO_VALIDATORS = ('', '', '')
+
+FETCH_STAGES = ('ttfb', 'download_time', 'parse_time', 'db_time')
+
+_parse_process_pool = None
+_parse_process_pool_lock = threading.Lock()
+
+
+class FetchError(Exception):
+    pass
+
+
+class HostDispatcher:
+    # Submits fetches to the pool host by host. At most `limit` fetches of a host are in the pool,
+    # the others wait in the host's queue and are submitted as the running ones finish, so the
+    # sources of one slow site never hold pool threads that other hosts could use.
+    def __init__(self, pool, limit):
+        self.pool = pool
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.running = collections.Counter()
+        self.waiting = collections.defaultdict(collections.deque)
+
+    def submit(self, url, fn, *args):
+        host = urlparse(url).netloc
+        with self.lock:
+            if self.running[host] >= self.limit:
+                self.waiting[host].append((fn, args))
+                return
+            self.running[host] += 1
+        self.start(host, fn, args)
+
+    def start(self, host, fn, args):
+        future = self.pool.submit(fn, *args)
+        future.add_done_callback(lambda future: self.on_done(host))
+
+    def on_done(self, host):
+        # runs in the pool thread that just finished, which hands its slot to the next fetch of the host
+        with self.lock:
+            if not self.waiting[host]:
+                self.running[host] -= 1
+                return
+            fn, args = self.waiting[host].popleft()
+        self.start(host, fn, args)
+
+
+def get_source_adapter(source, entry_cursor=''):
+    adapter = get_adapter(source, entry_cursor)
+    if adapter is None:
+        raise FetchError(f"unknown feed type: {source['type']}")
+    return adapter
+
+
+def is_streaming(source):
+    adapter = get_adapter(source)
+    return adapter is not None and adapter.streaming
+
+
+def new_metrics(source):
+    # FetchLog fields, filled in by the pipeline stages
+    return {'title': source['title'], 'feed_url': source['url'], 'started': timezone.now()}
+
+
+def fetch_source(adapter, validators, metrics):
+    # Returns the downloaded pages and the new (etag, last_modified, content_hash) validators.
+    # Pages are None when the source has not changed since the previous refresh. Validators
+    # describe the first page, the following ones are only requested by paginated adapters.
+    etag, last_modified, content_hash = validators
+    started = time.perf_counter()
+    try:
+        response = download_if_modified(adapter.get_fetch_url(), etag, last_modified)
+    except Exception as e:
+        metrics['status'] = getattr(getattr(e, 'response', None), 'status_code', None)
+        metrics['ttfb'] = time.perf_counter() - started
+        raise
+    # elapsed stops when the headers are parsed, the rest of the request is reading the body
+    metrics['status'] = response.status_code
+    metrics['bytes'] = len(response.content)
+    metrics['ttfb'] = response.elapsed.total_seconds()
+    metrics['download_time'] = max(time.perf_counter() - started - metrics['ttfb'], 0)
+    if response.status_code == 304:
+        return None, validators
+
+    new_validators = (
+        response.headers.get('ETag', ''),
+        response.headers.get('Last-Modified', ''),
+        hashlib.sha256(response.content).hexdigest()
+    )
+    if new_validators[2] == content_hash:
+        return None, new_validators
+
+    pages = [response.content]
+    fetched_urls = {adapter.get_fetch_url()}
+    next_url = adapter.get_next_url(response.content)
+    while next_url and next_url not in fetched_urls and len(pages) < settings.REFRESH_MAX_PAGES:
+        fetched_urls.add(next_url)
+        pages.append(download_if_modified(next_url).content)
+        metrics['bytes'] += len(pages[-1])
+        next_url = adapter.get_next_url(pages[-1])
+    metrics['download_time'] = max(time.perf_counter() - started - metrics['ttfb'], 0)
+    return pages, new_validators
+
+
+def open_stream(adapter, validators, metrics):
+    # conditional GET of a streaming source, None when the server answers 304
+    etag, last_modified, _ = validators
+    started = time.perf_counter()
+    try:
+        response = download_if_modified(adapter.get_fetch_url(), etag, last_modified, stream=True)
+    except Exception as e:
+        metrics['status'] = getattr(getattr(e, 'response', None), 'status_code', None)
+        metrics['ttfb'] = time.perf_counter() - started
+        raise
+    metrics['status'] = response.status_code
+    metrics['ttfb'] = response.elapsed.total_seconds()
+    if response.status_code == 304:
+        response.close()
+        return None
+    metrics['bytes'] = 0
+    metrics['download_time'] = 0
+    return response
+
+
+def read_stream(response, digest, metrics):
+    # body chunks within the download limits, timed and hashed as they are read
+    body = iter_response(response, settings.REFRESH_MAX_BYTES, settings.REFRESH_MAX_SECONDS)
+    while True:
+        read_started = time.perf_counter()
+        chunk = next(body, None)
+        metrics['download_time'] += time.perf_counter() - read_started
+        if chunk is None:
+            return
+        digest.update(chunk)
+        metrics['bytes'] += len(chunk)
+        yield chunk
+
+
+def stream_source(adapter, validators, metrics, stop_at):
+    # Streaming adapters parse while the body downloads, here in the fetch pool. Returns the feed
+    # data, the articles and the new validators; the data is None when the source has not changed.
+    # The content hash covers the bytes read before parsing stopped.
+    started = time.perf_counter()
+    response = open_stream(adapter, validators, metrics)
+    if response is None:
+        return None, None, validators
+
+    digest = hashlib.sha256()
+    try:
+        feed_data, entries = adapter.parse_stream(read_stream(response, digest, metrics), stop_at)
+        articles = list(entries)
+    finally:
+        response.close()
+    feed_data['entry_cursor'] = adapter.get_entry_cursor(articles)
+    metrics['parse_time'] = max(time.perf_counter() - started - metrics['ttfb'] - metrics['download_time'], 0)
+
+    new_validators = (
+        response.headers.get('ETag', ''),
+        response.headers.get('Last-Modified', ''),
+        digest.hexdigest()
+    )
+    if new_validators[2] == validators[2]:
+        return None, None, new_validators
+    return feed_data, articles, new_validators
+
+
+def download_stream(adapter, validators, metrics):
+    # A streaming source that is parsed in a worker process: the body is read here, within the
+    # download limits, and parsed there. Returns the chunks, None when the source has not
+    # changed, and the new validators. The content hash covers the whole body.
+    response = open_stream(adapter, validators, metrics)
+    if response is None:
+        return None, validators
+
+    digest = hashlib.sha256()
+    chunks = list(read_stream(response, digest, metrics))
+    new_validators = (
+        response.headers.get('ETag', ''),
+        response.headers.get('Last-Modified', ''),
+        digest.hexdigest()
+    )
+    if new_validators[2] == validators[2]:
+        return None, new_validators
+    return chunks, new_validators
+
+
+class KnownEntries:
+    # Tells a streaming parser where to stop reading. Feeds list the newest entries first, so once
+    # REFRESH_KNOWN_RUN stored entries follow each other the rest is stored already; a single one
+    # proves nothing, a pinned or bumped old entry can come first. Feeds that turn out not to list
+    # the newest first (an entry newer than the one before it) are read to the end.
+    def __init__(self, guid_hashes):
+        self.guid_hashes = guid_hashes
+        self.known_run = 0
+        self.previous_published = None
+        self.newest_first = True
+
+    def __call__(self, article):
+        if self.previous_published is not None and article['published'] > self.previous_published:
+            self.newest_first = False
+        self.previous_published = article['published']
+        if Article.make_guid_hash(article.get('guid'), article['url'], article['title']) not in self.guid_hashes:
+            self.known_run = 0
+            return False
+        self.known_run += 1
+        return self.newest_first and self.known_run >= settings.REFRESH_KNOWN_RUN
+
+
+def parse_source(adapter, pages):
+    # the entries generators are drained here, so parsing stays in the parse pool
+    feed_data = None
+    articles = []
+    for content in pages:
+        page_feed_data, entries = adapter.parse(content)
+        feed_data = feed_data or page_feed_data
+        articles.extend(entries)
+    feed_data['entry_cursor'] = adapter.get_entry_cursor(articles)
+    return feed_data, articles
+
+
+def timed_parse_source(adapter, pages):
+    # runs in the parse pool, a thread or a worker process: only plain records go back
+    started = time.perf_counter()
+    feed_data, articles = parse_source(adapter, pages)
+    return feed_data, articles, time.perf_counter() - started
+
+
+def timed_parse_stream(adapter, chunks, guid_hashes):
+    # a downloaded streaming body in a worker process, entries stop after a run of stored ones
+    started = time.perf_counter()
+    feed_data, entries = adapter.parse_stream(iter(chunks), KnownEntries(guid_hashes))
+    articles = list(entries)
+    feed_data['entry_cursor'] = adapter.get_entry_cursor(articles)
+    return feed_data, articles, time.perf_counter() - started
+
+
+def get_parse_process_pool():
+    # With REFRESH_PARSE_PROCESSES set, parsing runs in worker processes instead of threads,
+    # so CPU-heavy sources use more than one core. The pool lives as long as the process.
+    # Workers are spawned rather than forked, the fetch threads may hold locks at that moment,
+    # and set Django up before the first task imports this module.
+    global _parse_process_pool
+    if not settings.REFRESH_PARSE_PROCESSES:
+        return None
+    with _parse_process_pool_lock:
+        if _parse_process_pool is None:
+            _parse_process_pool = ProcessPoolExecutor(
+                max_workers=settings.REFRESH_PARSE_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup
+            )
+        return _parse_process_pool
+
+
+def reset_parse_process_pool(pool):
+    # a worker that died, killed for memory say, breaks the whole pool; the next refresh starts a new one
+    global _parse_process_pool
+    with _parse_process_pool_lock:
+        if _parse_process_pool is not pool:
+            return
+        _parse_process_pool = None
+    pool.shutdown(wait=False)
+
+
+def store_articles(feed, articles):
+    # writes in batches, so a large feed doesn't hold the write lock for one long transaction
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    batch_size = settings.REFRESH_BATCH_SIZE
+    for start in range(0, len(articles), batch_size):
+        for key, value in Article.add_articles(feed, articles[start:start + batch_size]).items():
+            counts[key] += value
+    return counts
+
+
+def store_source(source, feed_data, articles, validators, is_new_feed):
+    board = Board.get_board_by_title(source['board'])
+    feed = Feed.add_feed(
+        feed_data['title'],
+        feed_data['subtitle'],
+        feed_data['site_url'],
+        source['url'],
+        board
+    )
+    counts = store_articles(feed, articles)
+    # validators and the cursor are saved only after the articles, so a failed write is retried
+    Feed.set_validators(source['url'], validators, feed_data['entry_cursor'])
+
+    if counts['inserted'] or counts['updated']:
+        page_cache.invalidate_feed(feed.slug)
+    if (is_new_feed or counts['inserted']) and board is not None:
+        # sidebar and header show unread counters
+        page_cache.invalidate_board(board.slug)
+        page_cache.invalidate_boards()
+
+    # articles stored without a thumbnail but with candidate images, as (article id, candidates)
+    candidates_by_hash = {
+        Article.make_guid_hash(article.get('guid'), article['url'], article['title']): article['thumbnail_candidates']
+        for article in articles if not article['thumbnail'] and article.get('thumbnail_candidates')
+    }
+    pending_thumbnails = []
+    if candidates_by_hash:
+        for guid_hash, article_id in Article.get_ids_without_thumbnail(feed, candidates_by_hash).items():
+            pending_thumbnails.append((article_id, candidates_by_hash[guid_hash]))
+    return counts['inserted'], pending_thumbnails
+
+
+def refresh_feeds(sources, max_workers=None, per_host_limit=None, parse_workers=None, on_result=None):
+    # Four stages: network fetches run in a wide thread pool (bounded globally and per host),
+    # parsing runs in a small separate pool of threads or processes (with threads, streaming
+    # sources parse while downloading, in the fetch pool), and all DB writes happen in the calling thread
+    # as soon as a parsed feed is ready. Unchanged sources skip parsing and writing.
+    # Thumbnails that need image size probes are resolved in their own pool after the
+    # articles are stored and saved at the end.
+    # on_result is called in the calling thread with the result of each source as soon as it is stored.
+    max_workers = max_workers or settings.REFRESH_MAX_WORKERS
+    per_host_limit = per_host_limit or settings.REFRESH_PER_HOST_LIMIT
+    parse_workers = parse_workers or settings.REFRESH_PARSE_WORKERS
+
+    stored_validators = Feed.get_validators_by_urls([source['url'] for source in sources])
+    entry_cursors = Feed.get_entry_cursors_by_urls([source['url'] for source in sources])
+    # streaming sources stop reading after a run of entries that are already stored
+    known_guid_hashes = Article.get_recent_guid_hashes(
+        [source['url'] for source in sources if source['url'] in stored_validators and is_streaming(source)],
+        settings.REFRESH_KNOWN_ENTRIES
+    )
+    parsed = queue.Queue()
+    results = []
+    fetch_logs = []
+    thumbnail_futures = []
+
+    with ThreadPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS) as thumbnail_pool, \
+            ThreadPoolExecutor(max_workers=parse_workers) as parse_threads, \
+            ThreadPoolExecutor(max_workers=max_workers) as fetch_pool:
+        parse_processes = get_parse_process_pool()
+        parse_pool = parse_processes or parse_threads
+
+        def parsed_callback(source, validators, metrics):
+            def on_parsed(future):
+                try:
+                    feed_data, articles, metrics['parse_time'] = future.result()
+                    error = None
+                except Exception as e:
+                    if isinstance(e, BrokenExecutor):
+                        reset_parse_process_pool(parse_pool)
+                    feed_data, articles, error = None, None, e
+                parsed.put((source, feed_data, articles, validators, metrics, error))
+            return on_parsed
+
+        def fetch(source, validators):
+            # puts exactly one result on the queue for every source, the writer loop waits for all of them
+            metrics = new_metrics(source)
+            try:
+                adapter = get_source_adapter(source, entry_cursors.get(source['url'], ''))
+                guid_hashes = known_guid_hashes.get(source['url'], set())
+                # threads would parse a streaming source no faster than the fetch thread does while
+                # downloading, worker processes get the whole body instead
+                parse_while_downloading = adapter.streaming and parse_processes is None
+                if parse_while_downloading:
+                    stop_at = KnownEntries(guid_hashes)
+                    feed_data, articles, validators = stream_source(adapter, validators, metrics, stop_at)
+                elif adapter.streaming:
+                    pages, validators = download_stream(adapter, validators, metrics)
+                else:
+                    pages, validators = fetch_source(adapter, validators, metrics)
+                if parse_while_downloading:
+                    parsed.put((source, feed_data, articles, validators, metrics, None))
+                elif pages is None:
+                    parsed.put((source, None, None, validators, metrics, None))
+                else:
+                    if adapter.streaming:
+                        future = parse_pool.submit(timed_parse_stream, adapter, pages, guid_hashes)
+                    else:
+                        future = parse_pool.submit(timed_parse_source, adapter, pages)
+                    future.add_done_callback(parsed_callback(source, validators, metrics))
+            except Exception as e:
+                if isinstance(e, BrokenExecutor):
+                    reset_parse_process_pool(parse_pool)
+                parsed.put((source, None, None, validators, metrics, e))
+
+        dispatcher = HostDispatcher(fetch_pool, per_host_limit)
+        for source in sources:
+            dispatcher.submit(source['url'], fetch, source, stored_validators.get(source['url'], NO_VALIDATORS))
+
+        for _ in range(len(sources)):
+            source, feed_data, articles, validators, metrics, error = parsed.get()
+            inserted = 0
+            unchanged = error is None and feed_data is None
+            started = time.perf_counter()
+            if error is None and not unchanged:
+                try:
+                    is_new_feed = source['url'] not in stored_validators
+                    inserted, pending_thumbnails = store_source(source, feed_data, articles, validators, is_new_feed)
+                    for article_id, candidates in pending_thumbnails:
+                        thumbnail_futures.append(thumbnail_pool.submit(resolve_thumbnail, article_id, candidates))
+                except Exception as e:
+                    error = e
+            elif unchanged and validators != stored_validators.get(source['url'], NO_VALIDATORS):
+                # same body served with new headers
+                Feed.set_validators(source['url'], validators)
+            metrics['db_time'] = time.perf_counter() - started
+            metrics['entries_seen'] = len(articles or [])
+            metrics['entries_inserted'] = inserted
+            metrics['error'] = str(error or '')
+            metrics['total_time'] = sum(metrics.get(stage, 0) for stage in FETCH_STAGES)
+            fetch_logs.append(metrics)
+            if error is not None:
+                print(f"feed failed: {source['title']}: {error}")
+            elif unchanged:
+                print(f"feed not modified: {source['title']}")
+            else:
+                print(f"feed updated: {source['title']} in {metrics['total_time']:.2f}s")
+            result = {'source': source, 'inserted': inserted, 'unchanged': unchanged, 'error': error}
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+
+        thumbnails = {}
+        for future in as_completed(thumbnail_futures):
+            try:
+                article_id, thumbnail = future.result()
+            except Exception as e:
+                # the article keeps no thumbnail, the others are still saved
+                print(f"thumbnail failed: {e}")
+                continue
+            if thumbnail:
+                thumbnails[article_id] = thumbnail
+        Article.set_thumbnails(thumbnails)
+
+    FetchLog.add_logs(fetch_logs)
+    FetchLog.delete_older_than(settings.FETCH_LOG_KEEP_DAYS)
+    return results
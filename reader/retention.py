@@ -0,0 +1,120 @@
+import gzip
+import json
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from . import search
+from .config import load_boards
+from .models import Article, Feed, PrunedArticle
+
+ARCHIVE_FIELDS = ('id', 'feed__feed_url', 'guid_hash', 'title', 'description', 'url', 'published', 'thumbnail')
+
+
+def get_policies():
+    # Policies come from boards.yml: a "retention" mapping with keep_last and/or keep_days
+    # on a board applies to its feeds, a feed can override it, RETENTION_DEFAULT fills the rest.
+    policies = {}
+    for board in load_boards():
+        board_policy = {**settings.RETENTION_DEFAULT, **board.get('retention', {})}
+        for feed in board['feeds']:
+            policies[feed['url']] = {**board_policy, **feed.get('retention', {})}
+    return policies
+
+
+def get_prunable_articles(feed_id, policy):
+    # Unread articles are always kept. A read article goes when it is outside every configured
+    # window: not among the newest keep_last articles of its feed and older than keep_days.
+    keep_last = policy.get('keep_last')
+    keep_days = policy.get('keep_days')
+    if keep_last is None and keep_days is None:
+        return Article.objects.none()
+
+    articles = Article.objects.filter(feed_id=feed_id, is_read=True)
+    if keep_last is not None:
+        boundary = (
+            Article.objects.filter(feed_id=feed_id)
+            .order_by('-published', '-id')
+            .values('published', 'id')[keep_last:keep_last + 1]
+            .first()
+        )
+        if boundary is None:
+            return Article.objects.none()
+        articles = articles.filter(
+            models.Q(published__lt=boundary['published']) |
+            models.Q(published=boundary['published'], id__lte=boundary['id'])
+        )
+    if keep_days is not None:
+        articles = articles.filter(published__lt=timezone.now() - timedelta(days=keep_days))
+    return articles
+
+
+def archive_articles(archive, article_ids):
+    rows = Article.objects.filter(id__in=article_ids).values(*ARCHIVE_FIELDS)
+    for row in rows:
+        row['published'] = row['published'].isoformat()
+        archive.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def prune_feed(feed_id, policy, chunk_size, archive=None):
+    # Deletes in chunks, each in its own short transaction, so readers and the refresh worker
+    # never wait on one long write lock.
+    deleted = 0
+    prunable_articles = get_prunable_articles(feed_id, policy).order_by('published', 'id')
+    while True:
+        article_ids = list(prunable_articles.values_list('id', flat=True)[:chunk_size])
+        if not article_ids:
+            return deleted
+        with transaction.atomic():
+            if archive is not None:
+                archive_articles(archive, article_ids)
+            search.remove_articles(article_ids)
+            pruned_articles = Article.objects.filter(id__in=article_ids)
+            PrunedArticle.add_pruned(feed_id, pruned_articles.values_list('guid_hash', flat=True))
+            deleted += pruned_articles.delete()[0]
+
+
+def enable_incremental_vacuum():
+    # One-time conversion: auto_vacuum can only change from NONE with a full VACUUM, which
+    # rewrites the whole file and takes an exclusive lock for as long as that runs
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+    return True
+
+
+def compact_database():
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE reader_article")
+        cursor.execute("PRAGMA auto_vacuum")
+        # 2 is INCREMENTAL; in other modes freed pages stay in the file until a full VACUUM
+        if cursor.fetchone()[0] != 2:
+            return False
+        cursor.execute("PRAGMA incremental_vacuum")
+    return True
+
+
+def prune_articles(chunk_size=500, archive_path=None):
+    # Returns {feed id: deleted articles} for the feeds that lost articles
+    policies = get_policies()
+    default_policy = settings.RETENTION_DEFAULT
+    deleted_by_feed = {}
+
+    archive = gzip.open(archive_path, 'at', encoding='utf-8') if archive_path else None
+    try:
+        for feed_id, feed_url in Feed.objects.values_list('id', 'feed_url'):
+            deleted = prune_feed(feed_id, policies.get(feed_url, default_policy), chunk_size, archive)
+            if deleted:
+                deleted_by_feed[feed_id] = deleted
+    finally:
+        if archive is not None:
+            archive.close()
+    PrunedArticle.delete_older_than(settings.RETENTION_PRUNED_KEEP_DAYS)
+    return deleted_by_feed
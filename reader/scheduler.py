@@ -0,0 +1,117 @@
+import heapq
+import random
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .config import load_sources
+from .models import Feed, RefreshJob, RefreshJobEvent
+from .refresh import refresh_feeds
+
+
+def add_jitter(seconds):
+    spread = seconds * settings.REFRESH_JITTER
+    return seconds + random.uniform(-spread, spread)
+
+
+def adapt_interval(interval, inserted):
+    # feeds that keep producing articles are polled more often, quiet ones drift towards the maximum
+    if inserted:
+        interval = interval // 2
+    else:
+        interval = interval * 3 // 2
+    return max(settings.REFRESH_INTERVAL_MIN, min(settings.REFRESH_INTERVAL_MAX, interval))
+
+
+def backoff_delay(interval, failures):
+    return min(settings.REFRESH_BACKOFF_MAX, interval * 2 ** failures)
+
+
+class RefreshScheduler:
+    def __init__(self):
+        # failures of sources that have never been stored, so they have no Feed row yet
+        self.pending_backoff = {}
+
+    def build_queue(self, sources, now):
+        feeds = Feed.objects.filter(feed_url__in=[source['url'] for source in sources])
+        due_by_url = {feed.feed_url: feed.next_refresh_at for feed in feeds}
+
+        queue = []
+        for index, source in enumerate(sources):
+            due = due_by_url.get(source['url'])
+            if due is None:
+                due = self.pending_backoff.get(source['url'], (0, now))[1]
+            heapq.heappush(queue, (due, index, source))
+        return queue
+
+    def reschedule(self, result, now):
+        source = result['source']
+        feed = Feed.get_feed_by_url(source['url'])
+
+        if feed is None:
+            failures = self.pending_backoff.get(source['url'], (0, now))[0] + 1
+            delay = backoff_delay(settings.REFRESH_INTERVAL_MIN, failures)
+            self.pending_backoff[source['url']] = (failures, now + timedelta(seconds=add_jitter(delay)))
+            return
+        self.pending_backoff.pop(source['url'], None)
+
+        if result['error'] is None:
+            failure_count = 0
+            refresh_interval = adapt_interval(feed.refresh_interval, result['inserted'])
+            delay = refresh_interval
+        else:
+            failure_count = feed.failure_count + 1
+            refresh_interval = feed.refresh_interval
+            delay = backoff_delay(refresh_interval, failure_count)
+
+        Feed.objects.filter(pk=feed.pk).update(
+            refresh_interval=refresh_interval,
+            failure_count=failure_count,
+            next_refresh_at=now + timedelta(seconds=add_jitter(delay))
+        )
+
+    def run_job(self, job):
+        # A requested refresh covers every feed, due or not, and reports each one as it is stored.
+        # The job is finished whatever happens, a worker stopped halfway marks it as failed.
+        def on_result(result):
+            RefreshJobEvent.add_result(job.id, result)
+            self.reschedule(result, timezone.now())
+
+        error = 'refresh worker stopped'
+        try:
+            sources = load_sources()
+            RefreshJob.set_total(job.id, len(sources))
+            refresh_feeds(sources, on_result=on_result)
+            error = ''
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            raise
+        finally:
+            RefreshJob.finish(job.id, error)
+        RefreshJob.delete_older_than(settings.FETCH_LOG_KEEP_DAYS)
+
+    def run_once(self):
+        # runs a requested refresh job or refreshes every due feed,
+        # and returns the number of seconds until the next one is due
+        job = RefreshJob.claim_pending_job()
+        if job is not None:
+            self.run_job(job)
+            return 0
+
+        now = timezone.now()
+        queue = self.build_queue(load_sources(), now)
+
+        due_sources = []
+        while queue and queue[0][0] <= now:
+            due_sources.append(heapq.heappop(queue)[2])
+
+        if due_sources:
+            for result in refresh_feeds(due_sources):
+                self.reschedule(result, timezone.now())
+            return 0
+
+        if not queue:
+            return settings.REFRESH_POLL_INTERVAL
+        return max(0, (queue[0][0] - now).total_seconds())
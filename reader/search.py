@@ -0,0 +1,112 @@
+from django.db import connection
+from django.utils.html import escape
+
+from .utils import process_html
+
+FTS_TABLE = 'reader_article_fts'
+INDEX_BATCH_SIZE = 1000
+
+# snippet() and highlight() wrap matches in these, they are turned into <mark> after escaping
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def create_index(**kwargs):
+    # post_migrate handler: the FTS5 table lives outside the ORM, rowid is the article id
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5(title, description, tokenize='unicode61 remove_diacritics 2')"
+        )
+
+
+def index_articles(articles):
+    if not is_available():
+        return
+    rows = [(article.id, article.title, process_html(article.description)['text']) for article in articles]
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, title, description) VALUES (%s, %s, %s)", rows)
+
+
+def remove_articles(article_ids):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(article_id,) for article_id in article_ids])
+
+
+def rebuild_index():
+    from .models import Article
+
+    create_index()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    count = 0
+    batch = []
+    for article in Article.objects.only('id', 'title', 'description').iterator(chunk_size=INDEX_BATCH_SIZE):
+        batch.append(article)
+        if len(batch) >= INDEX_BATCH_SIZE:
+            index_articles(batch)
+            count += len(batch)
+            batch = []
+    index_articles(batch)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return count + len(batch)
+
+
+def build_match_query(query):
+    # every word becomes a quoted prefix term, so user input can't break the FTS5 syntax
+    terms = [word.replace('"', '""') for word in query.split()]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def highlight(text):
+    return escape(text).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def search(query, board_slug=None, feed_slug=None, limit=30):
+    # Returns (article, title html, snippet html) tuples ordered by bm25 rank, title matches weigh more
+    from .models import Article
+
+    match_query = build_match_query(query)
+    if not match_query or not is_available():
+        return []
+
+    sql = (
+        f"SELECT {FTS_TABLE}.rowid, "
+        f"highlight({FTS_TABLE}, 0, %s, %s), "
+        f"snippet({FTS_TABLE}, 1, %s, %s, '…', 24) "
+        f"FROM {FTS_TABLE} "
+        f"JOIN reader_article ON reader_article.id = {FTS_TABLE}.rowid "
+        f"JOIN reader_feed ON reader_feed.id = reader_article.feed_id "
+        f"LEFT JOIN reader_board ON reader_board.id = reader_feed.board_id "
+        f"WHERE {FTS_TABLE} MATCH %s"
+    )
+    params = [MATCH_START, MATCH_END, MATCH_START, MATCH_END, match_query]
+    if board_slug:
+        sql += " AND reader_board.slug = %s"
+        params.append(board_slug)
+    if feed_slug:
+        sql += " AND reader_feed.slug = %s"
+        params.append(feed_slug)
+    sql += f" ORDER BY bm25({FTS_TABLE}, 5.0, 1.0) LIMIT %s"
+    params.append(limit)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    articles = Article.objects.select_related('feed__board').in_bulk([row[0] for row in rows])
+    return [
+        (articles[article_id], highlight(title), highlight(snippet))
+        for article_id, title, snippet in rows if article_id in articles
+    ]
@@ -0,0 +1,112 @@
+import json
+
+from .parsers import get_rss, parse_rss, parse_rss_stream, parse_tj, parse_kanobu, parse_telegram
+from .parsers import get_last_telegram_message_id, get_telegram_message_id
+from .utils import transform_telegram_url_to_web_url
+
+ADAPTERS = {}
+
+
+def register(source_type):
+    # class decorator, the adapter handles sources with `type: <source_type>` in boards.yml
+    def decorator(adapter):
+        ADAPTERS[source_type] = adapter
+        return adapter
+    return decorator
+
+
+def get_adapter(source, entry_cursor=''):
+    adapter = ADAPTERS.get(source['type'])
+    if adapter is None:
+        return None
+    return adapter(source, entry_cursor)
+
+
+class SourceAdapter:
+    # An adapter only knows where a source lives and how to read it: parse() returns
+    # the feed data and a generator of entry records (title, description, url, guid,
+    # published, thumbnail and optionally thumbnail_candidates). Downloading, batching,
+    # dedup, thumbnails and storing are done by the refresh pipeline for every adapter.
+    # Incremental adapters keep an entry cursor, saved on the feed between refreshes.
+    # Streaming adapters parse the body while it downloads, see parse_stream().
+    streaming = False
+
+    def __init__(self, source, entry_cursor=''):
+        self.source = source
+        self.entry_cursor = entry_cursor
+
+    def get_fetch_url(self):
+        return self.source['url']
+
+    def get_next_url(self, content):
+        # the page to download after this one, for sources that are read page by page
+        return None
+
+    def parse(self, content):
+        raise NotImplementedError
+
+    def parse_stream(self, chunks, stop_at):
+        # like parse() for an iterator of body chunks; entries stop before the first one stop_at() accepts
+        raise NotImplementedError
+
+    def get_entry_cursor(self, entries):
+        return self.entry_cursor
+
+
+@register('RSS')
+class RSSAdapter(SourceAdapter):
+    streaming = True
+
+    def parse(self, content):
+        return parse_rss(get_rss(content), self.source['title'])
+
+    def parse_stream(self, chunks, stop_at):
+        return parse_rss_stream(chunks, self.source['title'], stop_at)
+
+
+@register('TJ')
+class TJAdapter(SourceAdapter):
+    def parse(self, content):
+        return parse_tj(content.decode('utf-8', errors='replace'), self.source['url'], self.source['title'])
+
+
+@register('Telegram')
+class TelegramAdapter(SourceAdapter):
+    # The cursor is the id of the newest stored message. The first refresh reads the latest
+    # page of the channel, later ones only request the messages after the cursor (?after=<id>),
+    # page by page until a page brings nothing newer.
+
+    def get_after_id(self):
+        return int(self.entry_cursor or 0)
+
+    def get_page_url(self, after_id):
+        return f"{transform_telegram_url_to_web_url(self.source['url'])}?after={after_id}"
+
+    def get_fetch_url(self):
+        if not self.get_after_id():
+            return transform_telegram_url_to_web_url(self.source['url'])
+        return self.get_page_url(self.get_after_id())
+
+    def get_next_url(self, content):
+        last_id = get_last_telegram_message_id(content)
+        if not self.get_after_id() or last_id <= self.get_after_id():
+            return None
+        return self.get_page_url(last_id)
+
+    def parse(self, content):
+        return parse_telegram(
+            content.decode('utf-8', errors='replace'),
+            self.source['url'],
+            self.source['title'],
+            after_id=self.get_after_id()
+        )
+
+    def get_entry_cursor(self, entries):
+        message_ids = [get_telegram_message_id(entry['guid'] or '') for entry in entries]
+        return str(max(message_ids + [self.get_after_id()]) or '')
+
+
+@register('Kanobu')
+class KanobuAdapter(SourceAdapter):
+    def parse(self, content):
+        return parse_kanobu(json.loads(content), self.source['site_url'], self.source['title'])
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # SQLite backend for a web process that reads while the refresh worker writes
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        # Take the write lock when the transaction starts. A deferred transaction that
+        # reads first fails at once with "database is locked" if another connection
+        # committed in between, busy_timeout only covers waiting for the lock.
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -1,3 +1,1085 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import threading
 
-# Create your tests here.
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import requests
+import yaml
+
+from asgiref.sync import async_to_sync
+from lxml import html as lxml_html
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from . import config, dates, page_cache, progress, refresh, retention, scheduler, search, sources, thumbnails, utils
+from .models import Board, Feed, Article, FetchLog, RefreshJob, RefreshJobEvent
+
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def make_entry(number, url_prefix='https://example.com', published=None, **fields):
+    # an entry as a source adapter returns it, fields override the defaults
+    return {
+        'title': f'Article {number}',
+        'description': '',
+        'url': f'{url_prefix}/{number}',
+        'published': published or datetime(2024, 1, 1, tzinfo=timezone.utc),
+        'thumbnail': '',
+        **fields
+    }
+
+
+def add_test_feed(entries=(), title='Feed', feed_url='https://example.com/rss', board=None):
+    board = board or Board.add_board('Board', 'board')
+    feed = Feed.add_feed(title, '', 'https://example.com/', feed_url, board)
+    Article.add_articles(feed, list(entries))
+    return feed
+
+
+def make_response(body=b'', status_code=200, elapsed=timedelta(0), headers=None):
+    # what download_if_modified returns, the body is readable both at once and as a stream
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(body)
+    response.elapsed = elapsed
+    response.headers.update(headers or {})
+    return response
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ReaderPageQueriesTest(TestCase):
+    # The number of queries per page must not depend on the number of boards, feeds or articles.
+    # Listing pages render from the fragment cache once it is warm.
+
+    @classmethod
+    def setUpTestData(cls):
+        for board_number in range(3):
+            board = Board.add_board(f'Board {board_number}', f'board-{board_number}')
+            for feed_number in range(3):
+                url_prefix = f'https://example.com/{board_number}/{feed_number}'
+                add_test_feed(
+                    [
+                        make_entry(
+                            article_number,
+                            url_prefix,
+                            datetime(2024, 1, 1, article_number, tzinfo=timezone.utc),
+                            description='Description'
+                        )
+                        for article_number in range(10)
+                    ],
+                    f'Feed {board_number} {feed_number}',
+                    f'{url_prefix}/rss',
+                    board
+                )
+        cls.feed = Feed.objects.get(slug='feed-1-2')
+        cls.article = Article.objects.filter(feed=cls.feed).first()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_index(self):
+        with self.assertNumQueries(6):
+            response = self.client.get('/')
+        self.assertContains(response, 'Article 9')
+        with self.assertNumQueries(0):
+            self.client.get('/')
+
+    def test_board(self):
+        with self.assertNumQueries(5):
+            response = self.client.get('/board-1/')
+        self.assertEqual(response.context['feed_slug'], 'feed-1-0')
+        with self.assertNumQueries(0):
+            self.client.get('/board-1/')
+
+    def test_feed(self):
+        with self.assertNumQueries(4):
+            response = self.client.get('/board-1/feed-1-2/')
+        self.assertEqual(response.context['selected_feed'], self.feed)
+        with self.assertNumQueries(0):
+            self.client.get('/board-1/feed-1-2/')
+
+    def test_article_marks_read(self):
+        url = f'/board-1/feed-1-2/{self.article.slug}/'
+        # article, savepoint, article/feed/board updates, release, then sidebar, article list and header
+        with self.assertNumQueries(9):
+            self.client.get(url)
+        self.assertTrue(Article.objects.get(pk=self.article.pk).is_read)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.context['selected_article'], self.article)
+
+    def test_new_articles_invalidate_feed_fragments(self):
+        self.client.get('/board-1/feed-1-2/')
+        Article.add_articles(self.feed, [
+            make_entry('fresh', published=datetime(2024, 2, 1, tzinfo=timezone.utc), title='Fresh article')
+        ])
+        page_cache.invalidate_feed(self.feed.slug)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/board-1/feed-1-2/')
+        self.assertContains(response, 'Fresh article')
+
+
+class FileCacheTest(TestCase):
+    # the configured file backend, where culling deletes random entries once it is full
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        caches = {'default': {**settings.CACHES['default'], 'LOCATION': directory.name}}
+        patcher = override_settings(CACHES=caches)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        add_test_feed([make_entry(number) for number in range(3)], board=Board.add_board('Board', 'board'))
+
+    def test_fragments_outlive_old_generations(self):
+        self.client.get('/board/feed/')
+        # fragments of past generations, as left behind by a day of refreshes
+        for number in range(1000):
+            cache.set(f'rune:orphan:{number}', 'fragment', settings.PAGE_CACHE_TIMEOUT)
+        with self.assertNumQueries(0):
+            self.client.get('/board/feed/')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class UnreadCountTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.board = Board.add_board('Board', 'board')
+        cls.feed = add_test_feed(
+            [make_entry(number, published=datetime(2024, 1, 1, number, tzinfo=timezone.utc)) for number in range(5)],
+            board=cls.board
+        )
+
+    def assertUnreadCounts(self, count):
+        self.assertEqual(Feed.objects.get(pk=self.feed.pk).unread_count, count)
+        self.assertEqual(Board.objects.get(pk=self.board.pk).unread_count, count)
+
+    def test_ingestion_and_reading_keep_counts(self):
+        self.assertUnreadCounts(5)
+        article = Article.objects.first()
+        Article.set_article_as_read(article)
+        Article.set_article_as_read(Article.objects.get(pk=article.pk))
+        self.assertUnreadCounts(4)
+
+    def test_bulk_mark_as_read(self):
+        first, second = Article.objects.order_by('id')[:2]
+        with self.assertNumQueries(6):
+            # savepoint, count per feed, UPDATE, feed and board counters, release
+            unread_by_feed = Article.mark_ids_as_read([first.id, second.id])
+        self.assertEqual(unread_by_feed, {self.feed.id: 2})
+        self.assertUnreadCounts(3)
+
+        response = self.client.post('/read/board/board/')
+        self.assertEqual(response.json(), {'marked': 3})
+        self.assertUnreadCounts(0)
+        self.assertFalse(Article.objects.filter(is_read=False).exists())
+
+    def test_rebuild(self):
+        Feed.objects.update(unread_count=100)
+        Board.objects.update(unread_count=-3)
+        Feed.rebuild_unread_counts()
+        self.assertUnreadCounts(5)
+
+
+class AddArticlesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.feed = add_test_feed([make_entry(number) for number in range(3)])
+
+    def make_batch(self):
+        # two new entries, one of them twice, one changed and one unchanged entry
+        return [
+            make_entry(3),
+            make_entry(4),
+            make_entry(4),
+            make_entry(1, description='Updated'),
+            make_entry(2),
+        ]
+
+    def test_counts_and_queries(self):
+        # savepoint, existing and pruned guids, insert, feed and board counters, update, search index (2), release
+        with self.assertNumQueries(10):
+            counts = Article.add_articles(self.feed, self.make_batch(), update=True)
+        self.assertEqual(counts, {'inserted': 2, 'updated': 1, 'skipped': 2})
+        self.assertEqual(Article.objects.get(title='Article 1').description, 'Updated')
+        self.assertEqual(Feed.objects.get(pk=self.feed.pk).unread_count, 5)
+
+    def test_existing_articles_are_kept_without_update(self):
+        counts = Article.add_articles(self.feed, self.make_batch())
+        self.assertEqual(counts, {'inserted': 2, 'updated': 0, 'skipped': 3})
+        self.assertEqual(Article.objects.get(title='Article 1').description, '')
+
+
+class ArticleIdentityTest(TestCase):
+
+    def test_same_headline_in_two_feeds(self):
+        first = add_test_feed([make_entry(1, 'https://one.example.com', title='Breaking news')])
+        second = add_test_feed(
+            [make_entry(1, 'https://two.example.com', title='Breaking news')],
+            'Other',
+            'https://two.example.com/rss'
+        )
+        self.assertEqual(Article.objects.filter(feed=first).count(), 1)
+        self.assertEqual(Article.objects.filter(feed=second).count(), 1)
+        self.assertEqual(Article.add_articles(second, [make_entry(1, 'https://two.example.com')])['skipped'], 1)
+
+    def test_backfill_of_articles_stored_without_guid_hash(self):
+        feed = add_test_feed()
+        for number in (1, 1, 2):
+            entry = make_entry(number)
+            Article.objects.create(
+                feed=feed, slug=f'article-{number}', title=entry['title'], url=entry['url'],
+                published=entry['published']
+            )
+
+        self.assertEqual(Article.backfill_guid_hashes(batch_size=2), (2, 1))
+        counts = Article.add_articles(feed, [make_entry(1), make_entry(2), make_entry(3)])
+        self.assertEqual((counts['inserted'], counts['skipped']), (1, 2))
+
+
+class ArticlePaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # pairs of articles share a publication date, so the id has to break ties
+        cls.feed = add_test_feed([
+            make_entry(number, published=datetime(2024, 1, 1, number // 2, tzinfo=timezone.utc))
+            for number in range(45)
+        ])
+
+    def test_pages_cover_every_article_once(self):
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = Article.get_page(Article.get_feed_articles('feed'), cursor, 10)
+            seen.extend(article.id for article in page)
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 45)
+        self.assertEqual(set(seen), set(Article.objects.values_list('id', flat=True)))
+
+    def test_api_pages(self):
+        response = self.client.get('/api/articles/', {'feed': 'feed', 'limit': 30})
+        data = response.json()
+        self.assertEqual(len(data['articles']), 30)
+
+        response = self.client.get('/api/articles/', {'feed': 'feed', 'cursor': data['next_cursor']})
+        data = response.json()
+        self.assertEqual(len(data['articles']), 15)
+        self.assertIsNone(data['next_cursor'])
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_board_listing_pages_across_feeds(self):
+        add_test_feed(
+            [make_entry(number, 'https://example.com/other') for number in range(5)],
+            'Other',
+            'https://example.com/other/rss',
+            self.feed.board
+        )
+        # board, page of articles with their feeds, then the header's boards
+        with self.assertNumQueries(3):
+            response = self.client.get('/articles/board/board/')
+        self.assertEqual(len(response.context['articles']), 30)
+
+        response = self.client.get('/articles/board/board/', {'cursor': response.context['next_cursor']})
+        self.assertEqual(len(response.context['articles']), 20)
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertContains(response, 'Other ·')
+        self.assertEqual(self.client.get('/articles/board/missing/').status_code, 404)
+
+    def test_unread_listings_walk_an_index(self):
+        for articles, index in (
+            (Article.get_unread_articles(), 'article_unread_idx'),
+            (Article.get_unread_articles().filter(feed=self.feed), 'article_feed_unread_idx'),
+        ):
+            sql, params = articles.order_by('-published', '-id')[:30].query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = ' '.join(row[-1] for row in cursor.fetchall())
+            self.assertIn(index, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_api_rejects_invalid_cursor(self):
+        response = self.client.get('/api/articles/', {'unread': 1, 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for slug in ('news', 'games'):
+            url_prefix = f'https://example.com/{slug}'
+            add_test_feed(
+                [
+                    make_entry(
+                        1, url_prefix,
+                        title=f'{slug} release notes',
+                        description='<p>The <b>rocket</b> launch & landing</p>'
+                    ),
+                    make_entry(
+                        2, url_prefix, datetime(2024, 1, 2, tzinfo=timezone.utc),
+                        title='Weather',
+                        description='Rain, then rockets of sunshine'
+                    ),
+                ],
+                slug.title(),
+                f'{url_prefix}/rss',
+                Board.add_board(slug.title(), slug)
+            )
+
+    def test_ranked_results_with_highlighted_snippets(self):
+        results = search.search('rocket')
+        self.assertEqual(len(results), 4)
+        snippets = [snippet for article, title, snippet in results]
+        self.assertIn('The <mark>rocket</mark> launch &amp; landing', snippets)
+        self.assertIn('Rain, then <mark>rockets</mark> of sunshine', snippets)
+
+    def test_filters(self):
+        results = search.search('release', board_slug='games')
+        self.assertEqual([article.feed.slug for article, title, snippet in results], ['games'])
+        self.assertEqual(search.search('weather', feed_slug='news')[0][1], '<mark>Weather</mark>')
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(search.search('"rocket AND OR ('), [])
+
+    def test_rebuild(self):
+        self.assertEqual(search.rebuild_index(), 4)
+        self.assertEqual(len(search.search('sunshine')), 2)
+
+
+class RetentionTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.feed = add_test_feed([
+            make_entry(number, published=datetime(2024, 1, 1 + number, tzinfo=timezone.utc)) for number in range(10)
+        ])
+        # the two oldest articles stay unread
+        Article.mark_as_read(Article.objects.filter(published__gte=datetime(2024, 1, 3, tzinfo=timezone.utc)))
+
+    def remaining_titles(self):
+        return set(Article.objects.values_list('title', flat=True))
+
+    def test_keep_last(self):
+        deleted = retention.prune_feed(self.feed.id, {'keep_last': 5, 'keep_days': None}, chunk_size=2)
+        self.assertEqual(deleted, 3)
+        self.assertEqual(self.remaining_titles(), {f'Article {number}' for number in (0, 1, 5, 6, 7, 8, 9)})
+
+    def test_pruned_articles_are_not_stored_again(self):
+        retention.prune_feed(self.feed.id, {'keep_last': 5, 'keep_days': None}, chunk_size=2)
+        unread_count = Feed.objects.get(pk=self.feed.pk).unread_count
+
+        # the source still lists every entry on the next refresh
+        entries = [
+            make_entry(number, published=datetime(2024, 1, 1 + number, tzinfo=timezone.utc)) for number in range(10)
+        ]
+        counts = Article.add_articles(self.feed, entries)
+        self.assertEqual((counts['inserted'], counts['skipped']), (0, 10))
+        self.assertEqual(Article.objects.count(), 7)
+        self.assertEqual(Feed.objects.get(pk=self.feed.pk).unread_count, unread_count)
+
+    def test_keep_last_or_keep_days(self):
+        # the keep_days cutoff falls between the publication dates of articles 2 and 3
+        days = (datetime.now(timezone.utc) - datetime(2024, 1, 4, tzinfo=timezone.utc)).days + 1
+        policy = {'keep_last': 5, 'keep_days': days}
+        self.assertEqual(retention.prune_feed(self.feed.id, policy, chunk_size=100), 1)
+        self.assertNotIn('Article 2', self.remaining_titles())
+
+    def test_no_policy_keeps_everything(self):
+        self.assertEqual(retention.prune_feed(self.feed.id, {'keep_last': None, 'keep_days': None}, 100), 0)
+
+
+class IncrementalVacuumTest(TransactionTestCase):
+    # VACUUM can't run inside the transaction every TestCase is wrapped in
+
+    def test_conversion_enables_compaction(self):
+        self.assertFalse(retention.compact_database())
+        call_command('prune_articles', enable_incremental_vacuum=True, stdout=io.StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA auto_vacuum')
+            self.assertEqual(cursor.fetchone()[0], 2)
+        self.assertTrue(retention.compact_database())
+
+
+class SourceAdapterTest(TestCase):
+
+    def setUp(self):
+        @sources.register('Test')
+        class TestAdapter(sources.SourceAdapter):
+            def parse(self, content):
+                feed_data = {'title': self.source['title'], 'subtitle': '', 'site_url': 'https://example.com/'}
+                entries = (
+                    make_entry(
+                        number % 4,
+                        published=datetime(2024, 1, 1 + number, tzinfo=timezone.utc),
+                        title=f'Article {number}',
+                        guid=str(number % 4)
+                    )
+                    for number in range(int(content))
+                )
+                return feed_data, entries
+
+        Board.add_board('Board', 'board')
+        self.source = {'title': 'Feed', 'url': 'https://example.com/rss', 'type': 'Test', 'board': 'Board'}
+
+    def tearDown(self):
+        del sources.ADAPTERS['Test']
+
+    @override_settings(CACHES=TEST_CACHES, REFRESH_BATCH_SIZE=2)
+    def test_pipeline_batches_and_dedups_entries(self):
+        adapter = refresh.get_source_adapter(self.source)
+        feed_data, articles = refresh.parse_source(adapter, [b'6'])
+        inserted, _ = refresh.store_source(self.source, feed_data, articles, refresh.NO_VALIDATORS, True)
+        self.assertEqual(inserted, 4)
+        self.assertEqual(Feed.objects.get(feed_url=self.source['url']).unread_count, 4)
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_unchanged_source_is_not_parsed(self):
+        headers = {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Apr 2024 10:00:00 GMT'}
+        with mock.patch.object(refresh, 'download_if_modified', return_value=make_response(b'3', headers=headers)):
+            refresh.refresh_feeds([self.source])
+        etag, last_modified, content_hash = Feed.get_validators_by_urls([self.source['url']])[self.source['url']]
+        self.assertEqual((etag, last_modified), ('"v1"', 'Mon, 01 Apr 2024 10:00:00 GMT'))
+
+        not_modified = make_response(status_code=304)
+        with mock.patch.object(refresh, 'download_if_modified', return_value=not_modified) as download, \
+                mock.patch.object(refresh, 'parse_source') as parse_source:
+            result = refresh.refresh_feeds([self.source])[0]
+        download.assert_called_once_with(self.source['url'], etag, last_modified)
+        self.assertTrue(result['unchanged'])
+        parse_source.assert_not_called()
+
+        # the same body under new headers is not parsed either, only the headers are kept
+        same_body = make_response(b'3', headers={'ETag': '"v2"'})
+        with mock.patch.object(refresh, 'download_if_modified', return_value=same_body), \
+                mock.patch.object(refresh, 'parse_source') as parse_source:
+            result = refresh.refresh_feeds([self.source])[0]
+        self.assertTrue(result['unchanged'])
+        parse_source.assert_not_called()
+        self.assertEqual(Feed.get_validators_by_urls([self.source['url']])[self.source['url']], ('"v2"', '', content_hash))
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_validators_are_saved_after_articles(self):
+        with mock.patch.object(refresh, 'download_if_modified', return_value=make_response(b'3')), \
+                mock.patch.object(Article, 'add_articles', side_effect=RuntimeError('disk full')):
+            result = refresh.refresh_feeds([self.source])[0]
+        self.assertIsNotNone(result['error'])
+        self.assertEqual(Feed.get_validators_by_urls([self.source['url']])[self.source['url']], ('', '', ''))
+
+        # the same body is stored by the next refresh
+        with mock.patch.object(refresh, 'download_if_modified', return_value=make_response(b'3')):
+            result = refresh.refresh_feeds([self.source])[0]
+        self.assertEqual(result['inserted'], 3)
+
+    def test_unknown_type(self):
+        with self.assertRaises(refresh.FetchError):
+            refresh.get_source_adapter({**self.source, 'type': 'Unknown'})
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_refresh_writes_fetch_log(self):
+        response = make_response(b'3', elapsed=timedelta(milliseconds=20))
+        with mock.patch.object(refresh, 'download_if_modified', return_value=response):
+            refresh.refresh_feeds([self.source])
+
+        log = FetchLog.objects.get()
+        self.assertEqual((log.status, log.bytes, log.entries_seen, log.entries_inserted), (200, 1, 3, 3))
+        self.assertEqual(log.ttfb, 0.02)
+        self.assertAlmostEqual(log.total_time, log.ttfb + log.download_time + log.parse_time + log.db_time)
+
+        metrics = self.client.get('/metrics/').content.decode()
+        self.assertIn('rune_feed_fetch_seconds{feed="https://example.com/rss",stage="ttfb"} 0.02', metrics)
+        self.assertIn('rune_feed_entries_inserted{feed="https://example.com/rss"} 3', metrics)
+
+
+class FetchConcurrencyTest(TestCase):
+
+    def test_slow_host_does_not_delay_other_hosts(self):
+        # the channels of one host can't start before another host's feed was fetched, which
+        # needs a free pool thread while they wait
+        sources = [
+            {'title': f'Channel {number}', 'url': f'https://t.me/channel{number}', 'type': 'TJ', 'board': 'Board'}
+            for number in range(6)
+        ] + [{'title': 'Other', 'url': 'https://example.com/rss', 'type': 'TJ', 'board': 'Board'}]
+        other_fetched = threading.Event()
+        lock = threading.Lock()
+        running = {'t.me': 0}
+        waits = []
+        max_running = []
+
+        def download(url, etag='', last_modified=''):
+            if 't.me' not in url:
+                other_fetched.set()
+                return make_response(status_code=304)
+            with lock:
+                running['t.me'] += 1
+                max_running.append(running['t.me'])
+            waits.append(other_fetched.wait(5))
+            with lock:
+                running['t.me'] -= 1
+            return make_response(status_code=304)
+
+        with mock.patch.object(refresh, 'download_if_modified', side_effect=download):
+            results = refresh.refresh_feeds(sources, max_workers=2, per_host_limit=1)
+
+        self.assertTrue(all(result['unchanged'] for result in results))
+        self.assertEqual(waits, [True] * 6)
+        self.assertEqual(max(max_running), 1)
+
+
+def make_telegram_page(message_ids, with_text=True):
+    text = '<div class="tgme_widget_message_text js-message_text">Message {} &amp; more. Second<br/><b>bold</b></div>'
+    messages = ''.join(
+        f'''<div class="tgme_widget_message_wrap"><div class="tgme_widget_message js-widget_message" data-post="channel/{message_id}">
+        <a class="tgme_widget_message_photo_wrap" style="width:100px;background-image:url('https://cdn.example.com/{message_id}.jpg')"></a>
+        {text.format(message_id) if with_text else ''}
+        <a class="tgme_widget_message_date" href="https://t.me/channel/{message_id}"><time datetime="2024-01-0{message_id}T10:00:00+00:00"></time></a>
+        </div></div>'''
+        for message_id in message_ids
+    )
+    return f'<html><head><meta charset="utf-8"></head><body>{messages}</body></html>'.encode()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TelegramAdapterTest(TestCase):
+
+    def setUp(self):
+        Board.add_board('Board', 'board')
+        self.source = {'title': 'Channel', 'url': 'https://t.me/channel', 'type': 'Telegram', 'board': 'Board'}
+
+    def refresh(self, pages_by_url):
+        requested_urls = []
+
+        def download(url, etag='', last_modified=''):
+            requested_urls.append(url)
+            return make_response(pages_by_url[url])
+
+        with mock.patch.object(refresh, 'download_if_modified', side_effect=download):
+            refresh.refresh_feeds([self.source])
+        return requested_urls
+
+    def test_entries_are_read_from_the_tree(self):
+        adapter = sources.get_adapter(self.source)
+        _, entries = adapter.parse(make_telegram_page([1]))
+        entry = next(entries)
+        self.assertEqual(entry['title'], 'Message 1 & more')
+        self.assertEqual(entry['description'], 'Message 1 &amp; more. Second<br><b>bold</b>')
+        self.assertEqual(entry['thumbnail'], 'https://cdn.example.com/1.jpg')
+        self.assertEqual((entry['guid'], entry['url']), ('channel/1', 'https://t.me/channel/1'))
+
+    def test_refresh_fetches_only_newer_pages(self):
+        self.assertEqual(self.refresh({'https://t.me/s/channel/': make_telegram_page([1, 2])}), ['https://t.me/s/channel/'])
+        self.assertEqual(Feed.get_feed_by_url(self.source['url']).entry_cursor, '2')
+
+        requested_urls = self.refresh({
+            'https://t.me/s/channel/?after=2': make_telegram_page([2, 3, 4]),
+            'https://t.me/s/channel/?after=4': make_telegram_page([4]),
+        })
+
+        self.assertEqual(requested_urls, ['https://t.me/s/channel/?after=2', 'https://t.me/s/channel/?after=4'])
+        self.assertEqual(Feed.get_feed_by_url(self.source['url']).entry_cursor, '4')
+        self.assertEqual(Article.objects.count(), 4)
+
+    def test_posts_without_text_are_kept_apart(self):
+        self.refresh({'https://t.me/s/channel/': make_telegram_page([1, 2], with_text=False)})
+        self.assertEqual(
+            list(Article.objects.order_by('id').values_list('title', 'description', 'url')),
+            [('Без названия', '', 'https://t.me/channel/1'), ('Без названия', '', 'https://t.me/channel/2')]
+        )
+
+    @override_settings(REFRESH_PARSE_PROCESSES=1)
+    def test_broken_process_pool_fails_the_source(self):
+        broken_pool = mock.Mock()
+        broken_pool.submit.side_effect = BrokenProcessPool('worker died')
+        with mock.patch.object(refresh, '_parse_process_pool', broken_pool):
+            self.refresh({'https://t.me/s/channel/': make_telegram_page([1])})
+            self.assertIsNone(refresh._parse_process_pool)
+        self.assertEqual(FetchLog.objects.get().error, 'worker died')
+        broken_pool.shutdown.assert_called_once_with(wait=False)
+
+    @override_settings(REFRESH_PARSE_PROCESSES=1)
+    def test_parse_in_worker_process(self):
+        self.addCleanup(setattr, refresh, '_parse_process_pool', None)
+        self.addCleanup(lambda: refresh._parse_process_pool.shutdown())
+        self.refresh({'https://t.me/s/channel/': make_telegram_page([1, 2])})
+        self.assertEqual(
+            list(Article.objects.order_by('published').values_list('title', 'published')),
+            [('Message 1 & more', datetime(2024, 1, 1, 10, tzinfo=timezone.utc)),
+             ('Message 2 & more', datetime(2024, 1, 2, 10, tzinfo=timezone.utc))]
+        )
+
+
+def make_rss(titles, days=None):
+    # every item is published on 1 April unless days gives its day of the month
+    days = days or [1] * len(titles)
+    items = ''.join(
+        f'<item><title>{title}</title><link>https://example.com/{title}</link>'
+        f'<pubDate>{day:02d} Apr 2024 10:00:00 +0000</pubDate></item>'
+        for title, day in zip(titles, days)
+    )
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>Feed</title><link>https://example.com/</link>{items}</channel></rss>'.encode()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StreamingRssTest(TestCase):
+
+    def setUp(self):
+        Board.add_board('Board', 'board')
+        self.source = {'title': 'Feed', 'url': 'https://example.com/rss', 'type': 'RSS', 'board': 'Board'}
+
+    def refresh(self, body):
+        with mock.patch.object(refresh, 'download_if_modified', return_value=make_response(body)):
+            return refresh.refresh_feeds([self.source])[0]
+
+    def titles(self):
+        return set(Article.objects.values_list('title', flat=True))
+
+    def test_reading_stops_after_run_of_known_entries(self):
+        self.refresh(make_rss(['one', 'two', 'three']))
+        self.assertEqual(Feed.get_feed_by_url(self.source['url']).site_url, 'https://example.com/')
+
+        result = self.refresh(make_rss(['four', 'one', 'two', 'three', 'old']))
+
+        self.assertEqual(result['inserted'], 1)
+        self.assertEqual(self.titles(), {'one', 'two', 'three', 'four'})
+
+    def test_pinned_old_entry_does_not_stop_reading(self):
+        self.refresh(make_rss(['one', 'two', 'three']))
+
+        result = self.refresh(make_rss(['one', 'four', 'two', 'three']))
+
+        self.assertEqual(result['inserted'], 1)
+        self.assertIn('four', self.titles())
+
+    def test_oldest_first_feed_is_read_to_the_end(self):
+        self.refresh(make_rss(['one', 'two', 'three'], days=[1, 2, 3]))
+
+        result = self.refresh(make_rss(['one', 'two', 'three', 'four'], days=[1, 2, 3, 4]))
+
+        self.assertEqual(result['inserted'], 1)
+        self.assertIn('four', self.titles())
+
+    def test_not_modified_and_same_body_are_skipped(self):
+        self.refresh(make_rss(['one', 'two']))
+        with mock.patch.object(refresh, 'download_if_modified', return_value=make_response(status_code=304)) as download:
+            self.assertTrue(refresh.refresh_feeds([self.source])[0]['unchanged'])
+        self.assertEqual(download.call_args.kwargs, {'stream': True})
+
+        with mock.patch.object(Article, 'add_articles') as add_articles:
+            self.assertTrue(self.refresh(make_rss(['one', 'two']))['unchanged'])
+        add_articles.assert_not_called()
+
+    @override_settings(REFRESH_PARSE_PROCESSES=1)
+    def test_parse_in_worker_process(self):
+        self.addCleanup(setattr, refresh, '_parse_process_pool', None)
+        self.addCleanup(lambda: refresh._parse_process_pool.shutdown())
+        self.refresh(make_rss(['one', 'two', 'three']))
+
+        result = self.refresh(make_rss(['four', 'one', 'two', 'three', 'old']))
+
+        self.assertEqual(result['inserted'], 1)
+        self.assertEqual(self.titles(), {'one', 'two', 'three', 'four'})
+
+    @override_settings(REFRESH_MAX_BYTES=200 * 1024)
+    def test_download_is_capped(self):
+        titles = [f'entry-{number}' for number in range(10000)]
+        result = self.refresh(make_rss(titles))
+        self.assertGreater(result['inserted'], 0)
+        self.assertLess(result['inserted'], len(titles))
+
+
+class ProbeCacheTest(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(thumbnails.time, 'monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_expire(self):
+        probe_cache = thumbnails.ProbeCache(ttl=60, max_size=10)
+        probe_cache.set('https://example.com/a.jpg', False)
+        self.assertIs(probe_cache.get('https://example.com/a.jpg'), False)
+        self.now += 61
+        self.assertIsNone(probe_cache.get('https://example.com/a.jpg'))
+
+    def test_expired_then_oldest_results_are_evicted(self):
+        probe_cache = thumbnails.ProbeCache(ttl=60, max_size=4)
+        probe_cache.set('expired', True)
+        self.now += 30
+        for url in ('first', 'second', 'third'):
+            probe_cache.set(url, True)
+        self.now += 31
+        probe_cache.set('fourth', True)
+        self.assertEqual(set(probe_cache.items), {'first', 'second', 'third', 'fourth'})
+
+        # full of live results, the older half goes
+        probe_cache.set('fifth', True)
+        self.assertEqual(set(probe_cache.items), {'third', 'fourth', 'fifth'})
+
+    def make_body(self, images_by_title):
+        items = ''.join(
+            f'<item><title>{title}</title><link>https://example.com/{title}</link><description>Text</description>'
+            f'<content:encoded><![CDATA[{"".join(f"<img src={image!r}>" for image in images)}]]></content:encoded></item>'
+            for title, images in images_by_title.items()
+        )
+        return (
+            '<?xml version="1.0"?><rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/">'
+            f'<channel><title>Feed</title><link>https://example.com/</link>{items}</channel></rss>'
+        ).encode()
+
+    def refresh(self, body, check_file_size):
+        Board.add_board('Board', 'board')
+        source = {'title': 'Feed', 'url': 'https://example.com/rss', 'type': 'RSS', 'board': 'Board'}
+        with mock.patch.object(thumbnails, 'probe_cache', thumbnails.ProbeCache(60, 10)), \
+                mock.patch.object(thumbnails, 'check_file_size', side_effect=check_file_size) as probe, \
+                mock.patch.object(refresh, 'download_if_modified', return_value=make_response(body)):
+            refresh.refresh_feeds([source])
+        return probe
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_probed_candidate_becomes_thumbnail(self):
+        body = self.make_body({'One': ['https://cdn.example.com/icon.png', 'https://cdn.example.com/photo.jpg']})
+        probe = self.refresh(body, lambda url: url.endswith('.jpg'))
+
+        self.assertEqual(Article.objects.get().thumbnail, 'https://cdn.example.com/photo.jpg')
+        self.assertEqual(probe.call_count, 2)
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_failed_probe_skips_only_its_article(self):
+        def check_file_size(url):
+            if 'broken' in url:
+                raise ValueError("invalid literal for int() with base 10: 'abc'")
+            return True
+
+        body = self.make_body({
+            'One': ['https://cdn.example.com/broken.jpg'],
+            'Two': ['https://cdn.example.com/photo.jpg'],
+        })
+        self.refresh(body, check_file_size)
+
+        self.assertEqual(dict(Article.objects.values_list('title', 'thumbnail')), {
+            'One': '', 'Two': 'https://cdn.example.com/photo.jpg'
+        })
+        self.assertEqual(FetchLog.objects.count(), 1)
+
+    def test_invalid_content_length_is_not_large(self):
+        response = make_response(headers={'Content-Length': 'abc'})
+        with mock.patch.object(utils.get_session(), 'head', return_value=response):
+            self.assertFalse(utils.check_file_size('https://cdn.example.com/photo.jpg'))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BoardsConfigTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'boards.yml')
+        patcher = mock.patch.object(config, 'config_cache', config.ConfigCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.boards = [
+            {'title': 'News', 'slug': 'news', 'feeds': [
+                {'title': 'One', 'url': 'https://example.com/one', 'type': 'RSS'},
+                {'title': 'Two', 'url': 'https://example.com/two', 'type': 'RSS'},
+            ]},
+            {'title': 'Games', 'slug': 'games', 'feeds': []},
+        ]
+        self.write_config()
+
+    def write_config(self):
+        with open(self.path, 'w', encoding='utf-8') as file:
+            yaml.safe_dump({'boards': self.boards}, file)
+
+    def test_unchanged_config_is_not_parsed_or_synced_again(self):
+        with override_settings(BOARDS_CONFIG=self.path):
+            sources = config.load_sources()
+            self.assertEqual(sorted(Board.objects.values_list('slug', flat=True)), ['games', 'news'])
+            with mock.patch.object(yaml, 'safe_load') as safe_load, self.assertNumQueries(0):
+                self.assertEqual(config.load_sources(), sources)
+            safe_load.assert_not_called()
+
+    def test_sync_writes_only_changes(self):
+        news = Board.add_board('News', 'news')
+        Board.add_board('Old', 'old')
+        Feed.add_feed('One', '', 'https://example.com/', 'https://example.com/one', news)
+        Feed.add_feed('Gone', '', 'https://example.com/', 'https://example.com/gone', news)
+        self.boards[0]['feeds'][0]['title'] = 'One renamed'
+        self.boards[1]['feeds'].append(self.boards[0]['feeds'].pop(0))
+
+        counts = config.sync_boards(self.boards)
+
+        self.assertEqual(counts, {
+            'boards_added': 1, 'boards_updated': 0, 'boards_removed': 1,
+            'feeds_added': 1, 'feeds_updated': 1, 'feeds_removed': 1
+        })
+        feeds = {feed.feed_url: feed for feed in Feed.objects.select_related('board')}
+        self.assertEqual(feeds['https://example.com/one'].title, 'One renamed')
+        self.assertEqual(feeds['https://example.com/one'].board.slug, 'games')
+        self.assertIsNone(feeds['https://example.com/gone'].board)
+        self.assertEqual(config.sync_boards(self.boards), dict.fromkeys(config.SYNC_COUNTS, 0))
+
+    def test_feeds_sharing_a_title_get_unique_slugs(self):
+        Feed.add_feed('Главное', '', 'https://example.com/', 'https://example.com/main', None)
+        self.boards[0]['feeds'] = [{'title': 'Главное', 'url': 'https://example.com/news-main', 'type': 'RSS'}]
+        self.boards[1]['feeds'] = [{'title': 'Главное', 'url': 'https://example.com/games-main', 'type': 'RSS'}]
+
+        self.assertEqual(config.sync_boards(self.boards)['feeds_added'], 2)
+        slugs = list(Feed.objects.values_list('slug', flat=True))
+        self.assertEqual(len(set(slugs)), 3)
+        self.assertIn('glavnoe', slugs)
+
+    def test_new_feeds_are_inserted_in_one_query(self):
+        self.boards[0]['feeds'] = [
+            {'title': f'Feed {number}', 'url': f'https://example.com/{number}', 'type': 'RSS'} for number in range(50)
+        ]
+        config.sync_boards(self.boards)
+        self.boards[1]['feeds'] = [
+            {'title': f'Feed {number}', 'url': f'https://example.com/games/{number}', 'type': 'RSS'} for number in range(50)
+        ]
+        # boards twice, feeds and one insert, inside a savepoint
+        with self.assertNumQueries(6):
+            self.assertEqual(config.sync_boards(self.boards)['feeds_added'], 50)
+        self.assertEqual(Feed.objects.values('slug').distinct().count(), 100)
+
+    def test_new_feeds_are_filled_in_by_first_refresh(self):
+        config.sync_boards(self.boards)
+        feed = Feed.objects.select_related('board').get(feed_url='https://example.com/two')
+        self.assertEqual((feed.title, feed.board.slug, feed.site_url), ('Two', 'news', ''))
+
+        source = {'title': 'Two', 'url': 'https://example.com/two', 'type': 'RSS', 'board': 'News'}
+        with mock.patch.object(refresh, 'download_if_modified', return_value=make_response(make_rss(['one']))):
+            refresh.refresh_feeds([source])
+        self.assertEqual(Feed.objects.get(pk=feed.pk).site_url, 'https://example.com/')
+
+
+class DateParsingTest(TestCase):
+
+    def test_formats(self):
+        utc = timezone.utc
+        cases = {
+            'Mon, 01 Apr 2024 10:00:00 +0000': datetime(2024, 4, 1, 10, tzinfo=utc),
+            'Mon, 01 Apr 2024 10:00:00 GMT': datetime(2024, 4, 1, 10, tzinfo=utc),
+            '2024-04-01T13:00:00+03:00': datetime(2024, 4, 1, 10, tzinfo=utc),
+            '2024-04-01T10:00:00.123Z': datetime(2024, 4, 1, 10, 0, 0, 123000, tzinfo=utc),
+            # no offset: TIME_ZONE, Europe/Saratov is UTC+4
+            '2024-04-01 14:00:00': datetime(2024, 4, 1, 10, tzinfo=utc),
+            '01-04-24': datetime(2024, 3, 31, 20, tzinfo=utc),
+        }
+        for value, expected in cases.items():
+            self.assertEqual(dates.parse_datetime(value), expected, value)
+
+    def test_winning_parser_is_cached_per_key(self):
+        parser = dates.DateParser()
+        parser.parse('01-04-24', 'feed')
+        with mock.patch.object(dates, 'DATETIME_PARSERS', ()):
+            self.assertEqual(parser.parse('02-04-24', 'feed').day, 2)
+            with self.assertRaises(ValueError):
+                parser.parse('02-04-24', 'other feed')
+
+
+class SqlitePragmasTest(TestCase):
+    def test_pragmas_applied_on_connect(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RefreshJobTest(TestCase):
+
+    def setUp(self):
+        Board.add_board('Board', 'board')
+        self.source = {'title': 'Feed', 'url': 'https://example.com/rss', 'type': 'RSS', 'board': 'Board'}
+
+    def collect_events(self, job_id, last_event_id=0):
+        async def collect():
+            return [message async for message in progress.stream_job_events(job_id, last_event_id)]
+        return async_to_sync(collect)()
+
+    def test_update_feeds_returns_job_at_once(self):
+        response = self.client.get('/update_feeds/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job']
+        self.assertEqual(response.json()['events'], f'/update_feeds/{job_id}/events/')
+
+        # a pending job covers the next request too
+        response = self.client.get('/update_feeds/')
+        self.assertContains(response, f'/update_feeds/{job_id}/events/')
+        self.assertEqual(RefreshJob.objects.count(), 1)
+
+    def test_worker_runs_job_and_streams_results(self):
+        job = RefreshJob.get_or_create_job(60)
+        response = make_response(make_rss(['one', 'two']))
+        with mock.patch.object(scheduler, 'load_sources', return_value=[self.source]), \
+                mock.patch.object(refresh, 'download_if_modified', return_value=response):
+            scheduler.RefreshScheduler().run_once()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total), (RefreshJob.DONE, 1))
+        messages = self.collect_events(job.id)
+        self.assertEqual(len(messages), 2)
+        self.assertIn('event: feed', messages[0])
+        self.assertIn('"inserted": 2', messages[0])
+        self.assertIn('event: done', messages[1])
+
+        # a reconnecting client only gets what it has not seen
+        last_event_id = job.events.get().id
+        messages = self.collect_events(job.id, last_event_id)
+        self.assertEqual(len(messages), 1)
+        self.assertIn('"completed": 1', messages[0])
+
+    def test_events_are_sent_while_the_job_runs(self):
+        RefreshJob.get_or_create_job(60)
+        job = RefreshJob.claim_pending_job()
+        RefreshJob.set_total(job.id, 2)
+        RefreshJobEvent.add_result(job.id, {'source': self.source, 'inserted': 1, 'unchanged': False, 'error': None})
+        url = f'/update_feeds/{job.id}/events/'
+
+        # under WSGI the stream is a plain generator, its first message comes before the job is over
+        response = self.client.get(url)
+        self.assertFalse(response.is_async)
+        messages = iter(response.streaming_content)
+        self.assertIn(b'"completed": 1', next(messages))
+        response.close()
+
+        response = async_to_sync(self.async_client.get)(url)
+        self.assertTrue(response.is_async)
+
+    def test_stopped_worker_fails_its_job(self):
+        job = RefreshJob.get_or_create_job(60)
+        with mock.patch.object(scheduler, 'load_sources', return_value=[self.source]), \
+                mock.patch.object(scheduler, 'refresh_feeds', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                scheduler.RefreshScheduler().run_once()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (RefreshJob.FAILED, 'refresh worker stopped'))
+        self.assertIn('"status": "failed"', self.collect_events(job.id)[-1])
+
+    def test_job_of_killed_worker_is_given_up(self):
+        RefreshJob.get_or_create_job(60)
+        job = RefreshJob.claim_pending_job()
+        self.assertEqual(RefreshJob.get_or_create_job(60), job)
+
+        RefreshJob.objects.filter(pk=job.pk).update(started=job.started - timedelta(seconds=61))
+        new_job = RefreshJob.get_or_create_job(60)
+        self.assertNotEqual(new_job, job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RefreshJob.FAILED)
+
+
+@override_settings(REFRESH_INTERVAL_MIN=60, REFRESH_INTERVAL_MAX=600, REFRESH_BACKOFF_MAX=1000, REFRESH_JITTER=0)
+class RefreshSchedulerTest(TestCase):
+
+    def setUp(self):
+        self.scheduler = scheduler.RefreshScheduler()
+        self.now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def reschedule(self, url, inserted=0, error=None):
+        self.scheduler.reschedule({'source': {'url': url}, 'inserted': inserted, 'error': error}, self.now)
+
+    def test_interval_adapts_within_bounds(self):
+        self.assertEqual(scheduler.adapt_interval(400, 3), 200)
+        self.assertEqual(scheduler.adapt_interval(100, 1), 60)
+        self.assertEqual(scheduler.adapt_interval(200, 0), 300)
+        self.assertEqual(scheduler.adapt_interval(500, 0), 600)
+
+    def test_backoff_doubles_up_to_maximum(self):
+        self.assertEqual([scheduler.backoff_delay(100, failures) for failures in range(5)], [100, 200, 400, 800, 1000])
+
+    def test_reschedule_stored_feed(self):
+        feed = add_test_feed()
+        Feed.objects.filter(pk=feed.pk).update(refresh_interval=400)
+
+        self.reschedule(feed.feed_url, inserted=5)
+        feed.refresh_from_db()
+        self.assertEqual((feed.refresh_interval, feed.failure_count), (200, 0))
+        self.assertEqual(feed.next_refresh_at, self.now + timedelta(seconds=200))
+
+        self.reschedule(feed.feed_url, error=refresh.FetchError('timeout'))
+        self.reschedule(feed.feed_url, error=refresh.FetchError('timeout'))
+        feed.refresh_from_db()
+        self.assertEqual((feed.refresh_interval, feed.failure_count), (200, 2))
+        self.assertEqual(feed.next_refresh_at, self.now + timedelta(seconds=800))
+
+        self.reschedule(feed.feed_url)
+        feed.refresh_from_db()
+        self.assertEqual((feed.refresh_interval, feed.failure_count), (300, 0))
+
+    def test_sources_never_stored_back_off_in_memory(self):
+        source = {'title': 'New', 'url': 'https://example.com/new'}
+        self.reschedule(source['url'], error=refresh.FetchError('timeout'))
+        self.reschedule(source['url'], error=refresh.FetchError('timeout'))
+        due = self.now + timedelta(seconds=240)
+        self.assertEqual(self.scheduler.pending_backoff[source['url']], (2, due))
+        self.assertEqual(self.scheduler.build_queue([source], self.now)[0][0], due)
+
+        # a stored feed has its own schedule
+        add_test_feed(feed_url=source['url'])
+        self.reschedule(source['url'], inserted=1)
+        self.assertNotIn(source['url'], self.scheduler.pending_backoff)
+
+
+class HttpSessionTest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(utils, '_session', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        utils.get_user_agent.cache_clear()
+        self.addCleanup(utils.get_user_agent.cache_clear)
+
+    def test_one_pooled_session(self):
+        session = utils.get_session()
+        self.assertIs(utils.get_session(), session)
+        adapter = session.get_adapter('https://example.com/')
+        self.assertIs(session.get_adapter('http://example.com/'), adapter)
+        self.assertEqual(adapter._pool_maxsize, settings.HTTP_POOL_MAXSIZE)
+        self.assertEqual(adapter.max_retries.total, settings.HTTP_RETRIES)
+
+    def test_fallback_user_agent(self):
+        with mock.patch.object(utils, 'UserAgent', side_effect=RuntimeError('no data')) as user_agent:
+            self.assertEqual(utils.get_user_agent(), utils.FALLBACK_USER_AGENT)
+            self.assertEqual(utils.get_session().headers['User-Agent'], utils.FALLBACK_USER_AGENT)
+        user_agent.assert_called_once()
+
+
+class ProcessHtmlTest(TestCase):
+
+    def test_text_and_first_sentence(self):
+        processed = utils.process_html('<p>Hello <b>world</b>. Second sentence</p>')
+        self.assertEqual(processed['text'], 'Hello world. Second sentence')
+        self.assertEqual(processed['first_sentence'].split(), ['Hello', 'world'])
+
+    def test_line_breaks_end_the_first_sentence(self):
+        self.assertEqual(utils.process_html('First line<br>second line. More')['first_sentence'], 'First line')
+        self.assertEqual(utils.process_html('Above<hr>below')['first_sentence'], 'Above')
+
+    def test_images_in_document_order(self):
+        processed = utils.process_html('<p><img src="a.jpg"> text <img src="b.png"></p><img alt="no source"><img src="c.gif">')
+        self.assertEqual(processed['images'], ['a.jpg', 'b.png', 'c.gif'])
+
+    def test_element_without_tail(self):
+        root = lxml_html.fromstring('<div><p>Inside. <img src="a.jpg"></p>tail</div>')
+        processed = utils.process_element(root.find('p'))
+        self.assertEqual((processed['text'], processed['images']), ('Inside. ', ['a.jpg']))
+
+    def test_empty_and_unparsable_input(self):
+        self.assertEqual(utils.process_html(None), {'text': '', 'first_sentence': '', 'images': []})
+        self.assertEqual(utils.process_html('  '), {'text': '', 'first_sentence': '', 'images': []})
+        self.assertEqual(utils.process_html('<html></html>'), {'text': '<html></html>', 'first_sentence': '', 'images': []})
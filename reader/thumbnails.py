@@ -0,0 +1,55 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .utils import check_file_size
+
+
+class ProbeCache:
+    # url -> (result, expiry time), shared by all probe threads of the process
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.items = {}
+
+    def get(self, url):
+        with self.lock:
+            item = self.items.get(url)
+            if item is None or item[1] < time.monotonic():
+                return None
+            return item[0]
+
+    def set(self, url, value):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.items) >= self.max_size:
+                self.items = {key: item for key, item in self.items.items() if item[1] >= now}
+            if len(self.items) >= self.max_size:
+                # still full of live entries, drop the oldest ones
+                for key in list(self.items)[:len(self.items) // 2]:
+                    del self.items[key]
+            self.items[url] = (value, now + self.ttl)
+
+
+probe_cache = ProbeCache(settings.THUMBNAIL_PROBE_TTL, settings.THUMBNAIL_PROBE_CACHE_SIZE)
+
+
+def is_large_image(url):
+    is_large = probe_cache.get(url)
+    if is_large is None:
+        is_large = check_file_size(url)
+        probe_cache.set(url, is_large)
+    return is_large
+
+
+def pick_thumbnail(candidates):
+    for url in candidates:
+        if is_large_image(url):
+            return url
+    return ''
+
+
+def resolve_thumbnail(article_id, candidates):
+    return article_id, pick_thumbnail(candidates)
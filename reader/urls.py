@@ -1,9 +1,21 @@
 from django.urls import path
-from .views import index, get_board, get_feed, get_article, update_feeds
+from .views import index, get_board, get_feed, get_article, update_feeds, get_unread, get_articles_api, search_articles
+from .views import mark_feed_read, mark_board_read, mark_older_read, mark_articles_read, get_metrics
+from .views import get_refresh_events, get_board_articles
 
 urlpatterns = [
     path('', index, name='index'),
     path('update_feeds/', update_feeds, name='init_feeds'),
+    path('update_feeds/<int:job_id>/events/', get_refresh_events, name='refresh_events'),
+    path('unread/', get_unread, name='get_unread'),
+    path('search/', search_articles, name='search_articles'),
+    path('api/articles/', get_articles_api, name='get_articles_api'),
+    path('articles/board/<slug:board_slug>/', get_board_articles, name='get_board_articles'),
+    path('metrics/', get_metrics, name='get_metrics'),
+    path('read/feed/<slug:feed_slug>/', mark_feed_read, name='mark_feed_read'),
+    path('read/board/<slug:board_slug>/', mark_board_read, name='mark_board_read'),
+    path('read/older/<int:days>/', mark_older_read, name='mark_older_read'),
+    path('read/articles/', mark_articles_read, name='mark_articles_read'),
     path('<slug:board_slug>/', get_board, name='get_board'),
     path('<slug:board_slug>/<slug:feed_slug>/', get_feed, name='get_feed'),
     path('<slug:board_slug>/<slug:feed_slug>/<slug:article_slug>/', get_article, name='get_article')
@@ -1,20 +1,67 @@
 import re
 import requests
 import io
+import threading
+import time
 
-from bs4 import BeautifulSoup
+from django.conf import settings
 from fake_useragent import UserAgent
+from functools import lru_cache
+from html import escape
+from lxml import etree
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+
+FALLBACK_USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_user_agent():
+    # UserAgent() loads its whole dataset, so it is built once per process
+    try:
+        return UserAgent().chrome
+    except Exception:
+        return FALLBACK_USER_AGENT
+
+
+def get_session():
+    # One keep-alive session per process: connections to the same host are pooled
+    # and reused by every helper below instead of a new TCP/TLS handshake per request.
+    global _session
+    with _session_lock:
+        if _session is None:
+            retries = Retry(
+                total=settings.HTTP_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=('GET', 'HEAD')
+            )
+            adapter = HTTPAdapter(
+                pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                max_retries=retries
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = get_user_agent()
+            _session = session
+        return _session
 
 
 def download(url):
     try:
-        headers = {'User-Agent': UserAgent().chrome}
-        timeout = 5
-        response = requests.get(
+        response = get_session().get(
             url,
-            headers=headers,
-            timeout=timeout)
+            timeout=settings.HTTP_TIMEOUT)
         response.raise_for_status()
         response.encoding = 'utf-8'
         return response.text
@@ -25,12 +72,9 @@ def download(url):
 
 def download_json(url):
     try:
-        headers = {'User-Agent': UserAgent().chrome}
-        timeout = 5
-        response = requests.get(
+        response = get_session().get(
             url,
-            headers=headers,
-            timeout=timeout)
+            timeout=settings.HTTP_TIMEOUT)
         response.raise_for_status()
         response.encoding = 'utf-8'
         return response.json()
@@ -39,13 +83,44 @@ def download_json(url):
         return getattr(e.response, "status_code", 400)
 
 
+def download_if_modified(url, etag='', last_modified='', stream=False):
+    # conditional GET: the server answers 304 with an empty body when the validators still match
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    response = get_session().get(
+        url,
+        headers=headers,
+        timeout=settings.HTTP_TIMEOUT,
+        stream=stream)
+    response.raise_for_status()
+    return response
+
+
+def iter_response(response, max_bytes, max_seconds):
+    # Body chunks of a streamed response. Stops quietly after max_bytes or max_seconds, the caller
+    # keeps what it got so far and FetchLog shows the bytes and time it took; HTTP_TIMEOUT still
+    # applies to every single read.
+    deadline = time.monotonic() + max_seconds
+    received = 0
+    try:
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            received += len(chunk)
+            if received > max_bytes or time.monotonic() > deadline:
+                return
+            yield chunk
+    finally:
+        response.close()
+
+
 def safe_download(url):
     max_parsable_content_length = 15 * 1024 * 1024
     try:
-        response = requests.get(
+        response = get_session().get(
             url=url,
-            timeout=5,
-            headers={'User-Agent': UserAgent().chrome},
+            timeout=settings.HTTP_TIMEOUT,
             stream=True  # the most important part — stream response to prevent loading everything into memory
         )
     except requests.exceptions.RequestException as e:
@@ -65,12 +140,9 @@ def safe_download(url):
 
 def check_file_size(url):
     try:
-        headers = {'User-Agent': UserAgent().chrome}
-        timeout = 5
-        response = requests.head(
+        response = get_session().head(
             url,
-            headers=headers,
-            timeout=timeout)
+            timeout=settings.HTTP_TIMEOUT)
         response.raise_for_status()
         size = int(response.headers.get("content-length", 0))
 
@@ -79,7 +151,8 @@ def check_file_size(url):
         else:
             return False
 
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # ValueError: a Content-Length that is not a number
         print(f"Error occurred while retrieving file size: {e}")
         return False
 
@@ -98,10 +171,55 @@ def extract_background_image_url(html):
         return ''
 
 
-def get_first_sentence(html):
-    html = re.sub(r'<br\s*/?>|<hr\s*/?>', '.', html)
-    soup = BeautifulSoup(html, 'html.parser')
-    text = soup.get_text(separator=' ')
+def process_html(html):
+    # One lxml parse and one tree walk give everything the parsers need from an HTML fragment:
+    # plain text, the first sentence and the image sources in document order.
+    if not html or not html.strip():
+        return process_element(None)
+    try:
+        root = lxml_html.fragment_fromstring(html, create_parent='div')
+    except (etree.ParserError, ValueError, AssertionError):
+        # lxml asserts on whole documents without a body
+        root = None
+    if root is None:
+        return {'text': html, 'first_sentence': get_first_sentence_from_text(html), 'images': []}
+    return process_element(root)
+
+
+def process_element(root):
+    # the same for an element of an already parsed document, without its tail
+    # text nodes in document order; line breaks count as sentence ends for the first sentence only
+    strings = []
+    sentence_strings = []
+    images = []
+    if root is not None:
+        for event, element in etree.iterwalk(root, events=('start', 'end', 'comment', 'pi')):
+            if event == 'start':
+                if element.tag == 'img' and element.get('src'):
+                    images.append(element.get('src'))
+                elif element.tag in ('br', 'hr'):
+                    sentence_strings.append('.')
+                elif isinstance(element.tag, str) and element.text:
+                    strings.append(element.text)
+                    sentence_strings.append(element.text)
+            elif element is not root and element.tail:
+                strings.append(element.tail)
+                sentence_strings.append(element.tail)
+
+    return {
+        'text': ''.join(strings),
+        'first_sentence': get_first_sentence_from_text(' '.join(sentence_strings)),
+        'images': images
+    }
+
+
+def get_inner_html(element):
+    # markup inside the element, like BeautifulSoup's decode_contents()
+    children = ''.join(lxml_html.tostring(child, encoding='unicode') for child in element)
+    return escape(element.text or '', quote=False) + children
+
+
+def get_first_sentence_from_text(text):
     cleaned_text = re.sub(r'<.*?>', '', text)
     sentence_delimiters = ['.', '?', '!']
     first_sentence = cleaned_text
@@ -114,6 +232,10 @@ def get_first_sentence(html):
     return first_sentence.strip()
 
 
+def get_first_sentence(html):
+    return process_html(html)['first_sentence']
+
+
 def truncate_string_by_dot(input_string):
     dot_index = input_string.find('.')
     if dot_index != -1:
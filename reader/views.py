@@ -1,139 +1,270 @@
-import yaml
-
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import require_POST
 
-from .models import Board, Feed, Article
-from .parsers import get_rss, parse_rss, parse_tj, parse_kanobu, parse_telegram
+from . import page_cache, search
+from .metrics import render_metrics
+from .models import Board, Feed, Article, RefreshJob
+from .progress import iter_job_events, stream_job_events
 
 
 FEED_LENGTH = 30
+API_MAX_LENGTH = 100
+ARTICLE_LIST_FIELDS = ('id', 'title', 'slug', 'published', 'is_read', 'feed_id')
 
-def index(request):
-    boards = Board.objects.all()
-    selected_board = Board.get_first_board()
 
-    feeds = Feed.get_feeds_by_board(selected_board)
-    selected_feed = Feed.get_first_feed_by_board(selected_board)
+def get_article_page(articles, cursor):
+    try:
+        articles, next_cursor = Article.get_page(articles.only(*ARTICLE_LIST_FIELDS), cursor, FEED_LENGTH)
+    except ValueError:
+        articles, next_cursor = [], None
+    return {'articles': articles, 'next_cursor': next_cursor}
+
 
-    articles = Article.get_articles_by_feed(selected_feed, limit=FEED_LENGTH)
-    is_article_selected = False
+def get_reader_page(board_slug=None, feed_slug=None, article_slug=None, cursor=None):
+    # Builds the feed.html context. Lists are lazy querysets that only run when their
+    # {% cache %} fragment is missing, and the board and feed shown by default are cached
+    # too, so a warm listing page doesn't touch the database.
+    # article pages come with both slugs, read state changes before any generation is looked up
     selected_article = None
+    if article_slug is not None:
+        selected_article = Article.get_article_by_slug(article_slug, feed_slug)
+        if selected_article and not selected_article.is_read:
+            Article.set_article_as_read(selected_article)
+            # the article list and the unread counters in the sidebar and header change
+            page_cache.invalidate_feed(feed_slug)
+            page_cache.invalidate_board(board_slug)
+            page_cache.invalidate_boards()
+
+    boards_generation = page_cache.get_generation(page_cache.boards_key())
+    if board_slug is None:
+        board_slug = page_cache.get_or_set(
+            f'index-board:{boards_generation}',
+            lambda: getattr(Board.get_first_board(), 'slug', None)
+        )
+
+    board_generation = page_cache.get_generation(page_cache.board_key(board_slug))
+    if feed_slug is None:
+        feed_slug = page_cache.get_or_set(
+            f'first-feed:{board_slug}:{board_generation}',
+            lambda: Feed.get_first_feed_slug_by_board_slug(board_slug)
+        )
+
+    feed_generation = page_cache.get_generation(page_cache.feed_key(feed_slug))
+
+    board_path = f"/{board_slug}/" if board_slug else "/"
+    return {
+        'title': 'RUNE RSS READER',
+        'board_slug': board_slug,
+        'feed_slug': feed_slug,
+        'selected_feed': SimpleLazyObject(lambda: Feed.get_feed_by_slug(feed_slug)),
+        'selected_article': selected_article,
+        'boards': Board.objects.only('id', 'title', 'slug', 'unread_count'),
+        'feeds': Feed.objects.filter(board__slug=board_slug).only('id', 'title', 'slug', 'unread_count').order_by('id'),
+        'article_page': SimpleLazyObject(lambda: get_article_page(Article.get_feed_articles(feed_slug), cursor)),
+        'cursor': cursor or '',
+        'board_path': board_path,
+        'feed_path': f"{board_path}{feed_slug}/" if feed_slug else board_path,
+        'is_article_selected': article_slug is not None,
+        'page_cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+        'boards_generation': boards_generation,
+        'board_generation': board_generation,
+        'feed_generation': feed_generation
+    }
+
+
+def index(request):
+    return render(request, 'feed.html', context=get_reader_page())
+
 
+def get_board(request, board_slug):
+    return render(request, 'feed.html', context=get_reader_page(board_slug))
+
+
+def get_board_articles(request, board_slug):
+    # articles of every feed of the board, newest first, paged like the feed and unread lists
+    board = Board.get_board_by_slug(board_slug)
+    if board is None:
+        raise Http404("Board not found")
+    articles = Article.get_board_articles(board_slug).select_related('feed')
+    articles = articles.only(*ARTICLE_LIST_FIELDS, 'feed__slug', 'feed__title')
     return render(
         request,
-        'feed.html',
+        'board.html',
         context={
             'title': 'RUNE RSS READER',
-            'selected_board': selected_board,
-            'selected_feed': selected_feed,
-            'selected_article': selected_article,
-            'boards': boards,
-            'feeds': feeds,
-            'articles': articles,
-            'is_article_selected': is_article_selected
+            'board': board,
+            'boards': Board.objects.only('id', 'title', 'slug', 'unread_count'),
+            'boards_generation': page_cache.get_generation(page_cache.boards_key()),
+            'page_cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+            **get_article_page(articles, request.GET.get('cursor'))
         }
     )
 
 
-def get_board(request, board_slug):
-    boards = Board.objects.all()
-    selected_board = Board.get_board_by_slug(board_slug)
-
-    feeds = Feed.get_feeds_by_board(selected_board)
-    selected_feed = Feed.get_first_feed_by_board(selected_board)
+def get_feed(request, board_slug, feed_slug):
+    cursor = request.GET.get('cursor')
+    return render(request, 'feed.html', context=get_reader_page(board_slug, feed_slug, cursor=cursor))
 
-    articles = Article.get_articles_by_feed(selected_feed, limit=FEED_LENGTH)
-    is_article_selected = False
-    selected_article = None
 
+def get_unread(request):
+    articles = Article.get_unread_articles().select_related('feed__board')
+    articles = articles.only(*ARTICLE_LIST_FIELDS, 'feed__slug', 'feed__title', 'feed__board__slug')
     return render(
         request,
-        'feed.html',
+        'unread.html',
         context={
             'title': 'RUNE RSS READER',
-            'selected_board': selected_board,
-            'selected_feed': selected_feed,
-            'selected_article': selected_article,
-            'boards': boards,
-            'feeds': feeds,
-            'articles': articles,
-            'is_article_selected': is_article_selected
+            'boards': Board.objects.only('id', 'title', 'slug', 'unread_count'),
+            'boards_generation': page_cache.get_generation(page_cache.boards_key()),
+            'page_cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+            **get_article_page(articles, request.GET.get('cursor'))
         }
     )
 
 
-def get_feed(request, board_slug, feed_slug):
-    boards = Board.objects.all()
-    selected_board = Board.get_board_by_slug(board_slug)
-
-    feeds = Feed.get_feeds_by_board(selected_board)
-    selected_feed = Feed.get_feed_by_slug(feed_slug)
-
-    articles = Article.get_articles_by_feed(selected_feed, limit=FEED_LENGTH)
-    is_article_selected = False
-    selected_article = None
-
+def search_articles(request):
+    query = request.GET.get('q', '').strip()
+    board_slug = request.GET.get('board') or None
+    feed_slug = request.GET.get('feed') or None
     return render(
         request,
-        'feed.html',
+        'search.html',
         context={
             'title': 'RUNE RSS READER',
-            'selected_board': selected_board,
-            'selected_feed': selected_feed,
-            'selected_article': selected_article,
-            'boards': boards,
-            'feeds': feeds,
-            'articles': articles,
-            'is_article_selected': is_article_selected
+            'boards': Board.objects.only('id', 'title', 'slug', 'unread_count'),
+            'boards_generation': page_cache.get_generation(page_cache.boards_key()),
+            'page_cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+            'query': query,
+            'board_slug': board_slug or '',
+            'feed_slug': feed_slug or '',
+            'results': search.search(query, board_slug, feed_slug, FEED_LENGTH) if query else []
         }
     )
 
 
-def get_article(request, board_slug, feed_slug, article_slug):
-    boards = Board.objects.all()
-    selected_board = Board.get_board_by_slug(board_slug)
+def get_articles_api(request):
+    # GET /api/articles/?feed=<slug> | ?board=<slug> | ?unread=1, paged with &cursor=<next_cursor>
+    if request.GET.get('feed'):
+        articles = Article.get_feed_articles(request.GET['feed'])
+    elif request.GET.get('board'):
+        articles = Article.get_board_articles(request.GET['board'])
+    else:
+        articles = Article.objects.all()
+    if request.GET.get('unread'):
+        articles = articles.filter(is_read=False)
 
-    feeds = Feed.get_feeds_by_board(selected_board)
-    selected_feed = Feed.get_feed_by_slug(feed_slug)
+    try:
+        limit = max(1, min(API_MAX_LENGTH, int(request.GET.get('limit', FEED_LENGTH))))
+        page, next_cursor = Article.get_page(
+            articles.select_related('feed__board'),
+            request.GET.get('cursor'),
+            limit
+        )
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor or limit")
 
-    articles = Article.get_articles_by_feed(selected_feed, limit=FEED_LENGTH)
-    is_article_selected = True
-    selected_article = Article.get_article_by_slug(article_slug)
+    return JsonResponse({
+        'articles': [
+            {
+                'id': article.id,
+                'title': article.title,
+                'description': article.description,
+                'url': article.url,
+                'published': article.published.isoformat(),
+                'thumbnail': article.thumbnail.name,
+                'is_read': article.is_read,
+                'feed': article.feed.slug,
+                'board': article.feed.board.slug if article.feed.board else None
+            }
+            for article in page
+        ],
+        'next_cursor': next_cursor
+    })
+
+
+def get_article(request, board_slug, feed_slug, article_slug):
+    return render(request, 'feed.html', context=get_reader_page(board_slug, feed_slug, article_slug))
 
-    Article.set_article_as_read(selected_article)
 
+def update_feeds(request):
+    # Fetching is done by the refresh_worker command, here we only start a refresh job and return
+    # its id at once. The wait page follows the job progress from the events stream.
+    job = RefreshJob.get_or_create_job(settings.REFRESH_JOB_TIMEOUT)
+    events_url = reverse('refresh_events', args=[job.id])
+    if not request.accepts('text/html'):
+        return JsonResponse({'job': job.id, 'status': job.status, 'events': events_url}, status=202)
     return render(
         request,
-        'feed.html',
+        'wait.html',
         context={
             'title': 'RUNE RSS READER',
-            'selected_board': selected_board,
-            'selected_feed': selected_feed,
-            'selected_article': selected_article,
-            'boards': boards,
-            'feeds': feeds,
-            'articles': articles,
-            'is_article_selected': is_article_selected
+            'boards': Board.objects.only('id', 'title', 'slug', 'unread_count'),
+            'boards_generation': page_cache.get_generation(page_cache.boards_key()),
+            'page_cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+            'job': job,
+            'events_url': events_url
         }
     )
 
 
-def update_feeds(request):
-    with open('boards/boards.yml', 'r', encoding='utf-8') as file:
-        data = yaml.safe_load(file)
-    boards = data['boards']
-    for board in boards:
-        Board.add_board(board['title'], board['slug'])
-        for feed in board['feeds']:
-            print(f"adding feed: {feed['title']}")
-            if feed['type'] == 'RSS':
-                raw_feed = get_rss(feed['url'])
-                parse_rss(raw_feed, feed['title'], board['title'])
-            elif feed['type'] == 'TJ':
-                parse_tj(feed['url'], feed['title'], board['title'])
-            elif feed['type'] == 'Telegram':
-                parse_telegram(feed['url'], feed['title'], board['title'])
-            elif feed['type'] == 'Kanobu':
-                parse_kanobu(feed['url'], feed['site_url'], feed['title'], board['title'])
-    print('DB updated!')
-    return redirect('index')
+async def get_refresh_events(request, job_id):
+    # Server-Sent Events stream of a refresh job, served without tying up a worker thread under ASGI;
+    # WSGI servers get a plain generator, Django would read an async one to the end before sending it
+    if not await RefreshJob.objects.filter(pk=job_id).aexists():
+        raise Http404("Refresh job not found")
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or 0)
+    except ValueError:
+        last_event_id = 0
+    if isinstance(request, ASGIRequest):
+        events = stream_job_events(job_id, last_event_id)
+    else:
+        events = iter_job_events(job_id, last_event_id)
+    return StreamingHttpResponse(
+        events,
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def read_state_response(request, unread_by_feed):
+    # forms send the page to return to, other clients get the number of articles marked as read
+    page_cache.invalidate_feeds_by_id(unread_by_feed)
+    next_url = request.POST.get('next')
+    if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    return JsonResponse({'marked': sum(unread_by_feed.values())})
+
+
+@require_POST
+def mark_feed_read(request, feed_slug):
+    return read_state_response(request, Article.mark_feed_as_read(feed_slug))
+
+
+@require_POST
+def mark_board_read(request, board_slug):
+    return read_state_response(request, Article.mark_board_as_read(board_slug))
+
+
+@require_POST
+def mark_older_read(request, days):
+    return read_state_response(request, Article.mark_older_as_read(days))
+
+
+@require_POST
+def mark_articles_read(request):
+    try:
+        article_ids = [int(article_id) for article_id in request.POST.getlist('ids')]
+    except ValueError:
+        return HttpResponseBadRequest("Invalid article id")
+    return read_state_response(request, Article.mark_ids_as_read(article_ids))
+
+
+def get_metrics(request):
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
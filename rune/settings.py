@@ -77,11 +77,51 @@ WSGI_APPLICATION = "rune.wsgi.application"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        "ENGINE": "reader.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
     }
 }
 
+# Applied to every new SQLite connection by the reader.sqlite3 backend, which also starts
+# transactions with BEGIN IMMEDIATE so writers queue up on the database lock. WAL lets
+# pages be read while the refresh worker writes, busy_timeout (ms) is how long a writer
+# waits for the lock before "database is locked". cache_size is in KiB when negative.
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 20000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64000,
+    "temp_store": "MEMORY",
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Page fragments are invalidated by the refresh worker, which runs in its own process,
+# so the default backend has to be shared between processes. A single-process setup can
+# switch to "django.core.cache.backends.locmem.LocMemCache".
+
+# The file backend keeps at most MAX_ENTRIES files and, once full, deletes a random
+# 1/CULL_FREQUENCY of them, live fragments and generation keys included. A config needs about
+# four fragments per feed plus the article pages read within PAGE_CACHE_TIMEOUT. Every write
+# lists the cache directory, so a much larger limit makes cache misses slow.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache",
+        "OPTIONS": {
+            "MAX_ENTRIES": 10000,
+            "CULL_FREQUENCY": 10,
+        },
+    }
+}
+
+# Lifetime of cached page fragments in seconds. Fragments are invalidated when their
+# data changes, the timeout only cleans up the ones that are no longer referenced.
+PAGE_CACHE_TIMEOUT = 60 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -107,7 +147,9 @@ AUTH_PASSWORD_VALIDATORS = [
 
 LANGUAGE_CODE = "en-us"
 
-TIME_ZONE = "UTC"
+# Pages show dates in this zone, and feed dates without an offset are read in it
+
+TIME_ZONE = "Europe/Saratov"
 
 USE_I18N = True
 
@@ -126,3 +168,83 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Feed refresh
+# Global cap on concurrent fetches, cap per remote host and size of the parsing pool
+
+BOARDS_CONFIG = BASE_DIR / "boards" / "boards.yml"
+
+REFRESH_MAX_WORKERS = 16
+REFRESH_PER_HOST_LIMIT = 4
+REFRESH_PARSE_WORKERS = 2
+
+# Worker processes for the parse stage, 0 parses in REFRESH_PARSE_WORKERS threads instead.
+# Processes only help with more than one core, benchmarks/parse_pool.py compares both.
+# With threads, streaming sources (RSS) parse in the fetch threads while they download and stop
+# after a run of stored entries; with processes their whole body is downloaded and parsed there.
+
+REFRESH_PARSE_PROCESSES = 0
+
+# Articles written per transaction when a refresh stores a feed
+
+REFRESH_BATCH_SIZE = 200
+
+# Pages downloaded per refresh from sources that are read page by page (Telegram channels)
+
+REFRESH_MAX_PAGES = 5
+
+# Streaming sources (RSS): the download stops after MAX_BYTES or MAX_SECONDS, and reading
+# stops after KNOWN_RUN entries in a row among the newest KNOWN_ENTRIES stored articles of
+# the feed; feeds that don't list the newest entries first are read to the end
+
+REFRESH_MAX_BYTES = 10 * 1024 * 1024
+REFRESH_MAX_SECONDS = 30
+REFRESH_KNOWN_ENTRIES = 50
+REFRESH_KNOWN_RUN = 3
+
+# Days of per-source refresh timings kept in FetchLog
+
+FETCH_LOG_KEEP_DAYS = 14
+
+# Thumbnail probing: worker threads, and how long (seconds) and how many image size checks are cached
+
+THUMBNAIL_WORKERS = 8
+THUMBNAIL_PROBE_TTL = 24 * 60 * 60
+THUMBNAIL_PROBE_CACHE_SIZE = 10000
+
+# Article retention used when boards.yml doesn't set one: keep_last articles per feed
+# and/or keep_days, None disables that rule. Unread articles are never deleted.
+
+RETENTION_DEFAULT = {"keep_last": None, "keep_days": None}
+
+# Pruned articles are remembered for this many days, so a source that still lists them
+# doesn't bring them back. Sources rarely list entries that old.
+
+RETENTION_PRUNED_KEEP_DAYS = 365
+
+# Shared HTTP session: timeout in seconds, retries for connection errors and 5xx/429,
+# number of hosts kept in the pool and keep-alive connections per host
+
+HTTP_TIMEOUT = 5
+HTTP_RETRIES = 2
+HTTP_POOL_CONNECTIONS = 64
+HTTP_POOL_MAXSIZE = REFRESH_PER_HOST_LIMIT
+
+# Refresh worker schedule, in seconds.
+# Feed intervals adapt between MIN and MAX, failing feeds back off up to BACKOFF_MAX.
+
+REFRESH_POLL_INTERVAL = 30
+REFRESH_INTERVAL_MIN = 5 * 60
+REFRESH_INTERVAL_MAX = 6 * 60 * 60
+REFRESH_BACKOFF_MAX = 24 * 60 * 60
+REFRESH_JITTER = 0.1
+
+# Refresh jobs started from the web page: how often the worker looks for a new job,
+# how long a running job may take before it counts as abandoned by a killed worker,
+# how often the progress stream checks for new results and sends a keep-alive comment
+
+REFRESH_JOB_POLL_INTERVAL = 2
+REFRESH_JOB_TIMEOUT = 30 * 60
+REFRESH_EVENTS_POLL_INTERVAL = 1
+REFRESH_EVENTS_KEEPALIVE = 15